@@ -0,0 +1,132 @@
+""" binID index.
+
+binIDs of a table are encoded once as int32 codes, i.e., positions in the
+sorted array of binIDs (the dictionary). Tables are aligned by binary search
+on dictionaries and integer takes, instead of hashing object (string) indexes.
+Aligned bins are sorted, as with np.intersect1d.
+
+"""
+import numpy as np
+
+
+def bin_codes(bins, codes=None):
+    """ Encode binIDs as positions in the sorted dictionary.
+
+    Sorted bins (e.g., tables made by DriverPower) are encoded without sorting.
+
+    Args:
+        bins (np.array): unique binIDs of rows.
+        codes (np.array): known codes of bins (e.g., cached with the data). None to compute.
+
+    Returns:
+        np.array: dictionary, i.e., sorted binIDs as fixed-width strings.
+        np.array: int32 code of each row.
+
+    """
+    bins = np.asarray(bins).astype(np.str_)
+    n = bins.shape[0]
+    if codes is None:
+        if n < 2 or (bins[1:] > bins[:-1]).all():
+            return bins, np.arange(n, dtype=np.int32)
+        codes = np.empty(n, dtype=np.int32)
+        codes[np.argsort(bins, kind='mergesort')] = np.arange(n, dtype=np.int32)
+    dictionary = np.empty_like(bins)
+    dictionary[codes] = bins
+    assert n < 2 or (dictionary[1:] > dictionary[:-1]).all(), 'binID is not unique.'
+    return dictionary, codes
+
+
+def bin_order(bins, codes=None):
+    """ Row positions that sort bins by binID.
+
+    Args:
+        bins (np.array): unique binIDs of rows.
+        codes (np.array): known codes of bins. None to compute.
+
+    Returns:
+        np.array: int32 row positions.
+
+    """
+    dictionary, codes = bin_codes(bins, codes)
+    return _code_rows(codes)
+
+
+def bin_index(bins, codes=None):
+    """ Lookup index of binIDs for repeated queries (see lookup_bins).
+
+    Args:
+        bins (np.array): unique binIDs of rows.
+        codes (np.array): known codes of bins. None to compute.
+
+    Returns:
+        tuple: (dictionary, row position of each dictionary entry).
+
+    """
+    dictionary, codes = bin_codes(bins, codes)
+    return dictionary, _code_rows(codes)
+
+
+def lookup_bins(index, query):
+    """ Row positions of query binIDs in a lookup index made by bin_index.
+
+    Only query binIDs are encoded, so a table can be queried many times
+    (e.g., once per chunk) at O(len(query) * log(len(bins))) each.
+
+    Args:
+        index (tuple): (dictionary, rows) from bin_index.
+        query (np.array): binIDs to find.
+
+    Returns:
+        np.array: int32 row position of each query binID; -1 if not found.
+
+    """
+    dictionary, rows = index
+    query = np.asarray(query).astype(np.str_)
+    if dictionary.shape[0] == 0:
+        return np.full(query.shape[0], -1, dtype=np.int32)
+    pos = np.minimum(np.searchsorted(dictionary, query), dictionary.shape[0] - 1)
+    found = rows[pos]
+    found[dictionary[pos] != query] = -1
+    return found
+
+
+def find_bins(bins, query, codes=None):
+    """ Row positions of query binIDs.
+
+    Args:
+        bins (np.array): unique binIDs of rows.
+        query (np.array): binIDs to find.
+        codes (np.array): known codes of bins. None to compute.
+
+    Returns:
+        np.array: int32 row position of each query binID; -1 if not found.
+
+    """
+    return lookup_bins(bin_index(bins, codes), query)
+
+
+def align_bins(*bins):
+    """ binIDs in all tables and their row positions in each table.
+
+    Args:
+        *bins (np.array): unique binIDs of rows of each table.
+
+    Returns:
+        np.array: sorted common binIDs.
+        list: int32 row positions of common binIDs in each table.
+
+    """
+    encoded = [bin_codes(i) for i in bins]
+    common = encoded[0][0]
+    for dictionary, codes in encoded[1:]:
+        common = np.intersect1d(common, dictionary, assume_unique=True)
+    # common bins are in every dictionary
+    rows = [_code_rows(codes)[np.searchsorted(dictionary, common)] for dictionary, codes in encoded]
+    return common, rows
+
+
+def _code_rows(codes):
+    """ Row position of each code (inverse permutation of codes)."""
+    rows = np.empty(codes.shape[0], dtype=np.int32)
+    rows[codes] = np.arange(codes.shape[0], dtype=np.int32)
+    return rows
@@ -0,0 +1,166 @@
+""" On-disk cache of predicted number of mutations (or mutation rates).
+
+Predictions are keyed by content hashes of the model, the feature table
+and the tested bins, so that repeated ``infer`` runs that only change
+test parameters (e.g., --method, --scale, --funcScoreCut) skip the prediction step.
+The cache is bounded in size and evicts the least recently used entries.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger('CACHE')
+
+
+def pred_cache_key(cache_dir, model_path, X_path, bins, y=None, dtype='float64'):
+    """ Make the cache key for a prediction.
+
+    File hashes are memorized by (path, size, mtime) in the cache directory,
+    so unchanged large feature tables are only read once.
+
+    Args:
+        cache_dir (str): cache directory.
+        model_path (str): path to the model bundle or pickle.
+        X_path (str): path to the feature table.
+        bins (np.array): binIDs to predict.
+        y (pd.df): response table of the bins, for predicted number of mutations.
+            None for predicted mutation rates, which do not depend on the response.
+        dtype (str): data type of features used in prediction.
+
+    Returns:
+        str: hex digest.
+
+    """
+    memo = _read_memo(cache_dir)
+    h = hashlib.sha1()
+    h.update(hash_path(model_path, memo).encode())
+    h.update(hash_path(X_path, memo).encode())
+    h.update('\n'.join(np.asarray(bins).astype(str)).encode())
+    if y is None:
+        h.update(b'rate')
+    else:
+        # number of mutations depend on length and N
+        h.update(np.ascontiguousarray(y.length.values, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(y.N.values, dtype=np.float64).tobytes())
+    h.update('dtype:{}'.format(np.dtype(dtype).name).encode())
+    _write_memo(cache_dir, memo)
+    return h.hexdigest()
+
+
+def hash_path(path, memo=None, block_size=1 << 20):
+    """ Content hash of a file or a directory (e.g., model bundle and feature store).
+
+    Args:
+        path (str): path to a file or directory.
+        memo (dict): known file hashes, {abspath: [size, mtime_ns, digest]}. Updated in place.
+        block_size (int): bytes per read.
+
+    Returns:
+        str: hex digest.
+
+    """
+    memo = dict() if memo is None else memo
+    if os.path.isdir(path):
+        h = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                fpath = os.path.join(root, name)
+                h.update(os.path.relpath(fpath, path).encode())
+                h.update(hash_path(fpath, memo, block_size).encode())
+        return h.hexdigest()
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    if memo.get(path, [None])[:2] == stamp:
+        return memo[path][2]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    memo[path] = stamp + [h.hexdigest()]
+    return memo[path][2]
+
+
+def read_pred_cache(cache_dir, key):
+    """ Read cached predictions.
+
+    Args:
+        cache_dir (str): cache directory.
+        key (str): cache key from pred_cache_key.
+
+    Returns:
+        pd.Series: nPred indexed by binID. None if not cached.
+
+    """
+    path = os.path.join(cache_dir, key + '.npz')
+    if not os.path.isfile(path):
+        return None
+    # mark as recently used
+    os.utime(path, None)
+    with np.load(path) as cached:
+        pred = pd.Series(cached['nPred'], index=pd.Index(cached['binID'], name='binID'), name='nPred')
+    logger.info('Load cached predictions for {} bins from {}'.format(pred.shape[0], path))
+    return pred
+
+
+def save_pred_cache(cache_dir, key, pred, max_size=10):
+    """ Save predictions to the cache and evict least recently used entries.
+
+    Args:
+        cache_dir (str): cache directory.
+        key (str): cache key from pred_cache_key.
+        pred (pd.Series): nPred indexed by binID.
+        max_size (float): maximum size of the cache in GB.
+
+    Returns:
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npz')
+    tmp_path = '{}.{}.tmp.npz'.format(os.path.join(cache_dir, key), os.getpid())
+    np.savez(tmp_path, binID=pred.index.values.astype(np.str_), nPred=pred.values)
+    os.replace(tmp_path, path)
+    logger.info('Save predictions to cache {}'.format(path))
+    evict_cache(cache_dir, max_size)
+
+
+def evict_cache(cache_dir, max_size):
+    """ Remove least recently used predictions until the cache is within max_size GB."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+            st = os.stat(os.path.join(cache_dir, name))
+            entries.append((st.st_mtime, st.st_size, name))
+    entries.sort()
+    total = sum(i[1] for i in entries)
+    max_bytes = max_size * 1024 ** 3
+    for mtime, size, name in entries:
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total -= size
+        logger.info('Evict cached predictions {}'.format(name))
+
+
+def _read_memo(cache_dir):
+    path = os.path.join(cache_dir, 'file_hash.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+
+def _write_memo(cache_dir, memo):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'file_hash.json')
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(memo, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,197 @@
+""" Checkpoints of GBM training.
+
+Boosters of each fold are saved every few rounds to [project_name].GBM.checkpoint
+in the model directory, together with the eval history (as a booster attribute)
+and the fold of each training bin (folds.npz). Training can then be resumed
+from the last saved round of each fold; early stopping continues from the eval history.
+Resumed rounds are identical to an uninterrupted run only if training is deterministic,
+i.e., without row or column subsampling.
+
+"""
+import collections
+import json
+import logging
+import os
+import shutil
+from driverpower.dataIO import read_folds, save_folds
+import warnings
+with warnings.catch_warnings():
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    import xgboost as xgb
+
+
+logger = logging.getLogger('CHECKPOINT')
+
+
+def checkpoint_dir(out_dir, project_name):
+    """ Path to the checkpoint directory of a project."""
+    return os.path.join(out_dir, '{}.GBM.checkpoint'.format(project_name))
+
+
+def start_checkpoint(path, bins, fold, resume=False):
+    """ Make the checkpoint directory and save folds.
+
+    Args:
+        path (str): checkpoint directory.
+        bins (np.array): binIDs of training rows.
+        fold (np.array): fold of each row.
+        resume (bool): keep saved boosters. Otherwise, the directory is emptied.
+
+    Returns:
+
+    """
+    if os.path.isdir(path) and not resume:
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+    save_folds(path, bins, fold)
+
+
+def read_checkpoint_folds(path):
+    """ Folds saved in a checkpoint directory. None if there is no checkpoint."""
+    if not os.path.isdir(path):
+        return None
+    return read_folds(path)
+
+
+def remove_checkpoint(path):
+    """ Remove the checkpoint directory after the model is saved."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+        logger.info('Checkpoints removed from {}'.format(path))
+
+
+def sampling_params(param):
+    """ Row and column subsampling parameters below 1, which make resumed training differ.
+
+    The random state of xgboost is not saved in checkpoints, so resumed rounds draw
+    different rows and columns than an uninterrupted run.
+
+    Args:
+        param (dict): xgboost parameters.
+
+    Returns:
+        dict: {name: value} of subsample and colsample_* parameters below 1.
+
+    """
+    return {k: v for k, v in param.items()
+            if (k == 'subsample' or k.startswith('colsample_')) and v is not None and float(v) < 1}
+
+
+def save_fold_checkpoint(path, k, bst, history, finished=False):
+    """ Save the booster and eval history of fold k.
+
+    The eval history is stored as booster attributes, so both are written to
+    one file, which replaces the previous checkpoint atomically.
+
+    Args:
+        path (str): checkpoint directory.
+        k (int): fold.
+        bst (xgb.Booster): booster.
+        history (dict): {data: {metric: [score per round]}} of rounds trained on the current data.
+        finished (bool): training of the fold is finished.
+
+    Returns:
+
+    """
+    bst.set_attr(dp_history=json.dumps(history), dp_finished=str(int(finished)))
+    tmp_path = os.path.join(path, 'fold{}.tmp.json'.format(k))
+    bst.save_model(tmp_path)
+    os.replace(tmp_path, os.path.join(path, 'fold{}.json'.format(k)))
+    bst.set_attr(dp_history=None, dp_finished=None)
+
+
+def read_fold_checkpoint(path, k):
+    """ Read the booster and eval history of fold k.
+
+    Args:
+        path (str): checkpoint directory.
+        k (int): fold.
+
+    Returns:
+        xgb.Booster: booster. None if fold k has no checkpoint.
+        dict: eval history.
+        bool: training of the fold is finished.
+
+    """
+    bst_path = os.path.join(path, 'fold{}.json'.format(k))
+    if not os.path.isfile(bst_path):
+        return None, None, False
+    bst = xgb.Booster(model_file=bst_path)
+    history = json.loads(bst.attr('dp_history'))
+    finished = bst.attr('dp_finished') == '1'
+    bst.set_attr(dp_history=None, dp_finished=None)
+    return bst, history, finished
+
+
+def history_rounds(history):
+    """ Number of rounds in an eval history."""
+    for metrics in history.values():
+        for scores in metrics.values():
+            return len(scores)
+    return 0
+
+
+def resume_early_stopping(bst, history, rounds):
+    """ Make an early stopping callback with the state after the rounds in history.
+
+    Args:
+        bst (xgb.Booster): booster from the checkpoint.
+        history (dict): eval history from the checkpoint.
+        rounds (int): early stopping rounds.
+
+    Returns:
+        xgb.callback.EarlyStopping: callback to pass to xgb.train.
+        bool: early stopping was already reached.
+
+    """
+    es = xgb.callback.EarlyStopping(rounds=rounds)
+    # replay eval history; epochs count from the last round of bst as in xgb.train
+    es.before_training(bst)
+    n_round = history_rounds(history)
+    stop = False
+    for i in range(n_round):
+        log = collections.OrderedDict(
+            (data, collections.OrderedDict((metric, scores[:i+1]) for metric, scores in metrics.items()))
+            for data, metrics in history.items())
+        stop = es.after_iteration(bst, i - n_round, log)
+    return es, stop
+
+
+class FoldCheckpoint(xgb.callback.TrainingCallback):
+    """ xgboost callback saving the booster and eval history of fold k every interval rounds.
+
+    Args:
+        path (str): checkpoint directory.
+        k (int): fold.
+        interval (int): number of rounds between checkpoints.
+        history (dict): eval history of rounds before this training session.
+
+    """
+
+    def __init__(self, path, k, interval, history=None):
+        super(FoldCheckpoint, self).__init__()
+        self.path = path
+        self.k = k
+        self.interval = interval
+        self.history = history if history is not None else dict()
+        self._evals_log = dict()
+
+    def after_iteration(self, model, epoch, evals_log):
+        self._evals_log = evals_log
+        if (epoch + 1) % self.interval == 0:
+            save_fold_checkpoint(self.path, self.k, model, self._merged_history())
+            logger.info('Fold {}: checkpoint at round {}'.format(self.k, model.num_boosted_rounds()))
+        return False
+
+    def after_training(self, model):
+        save_fold_checkpoint(self.path, self.k, model, self._merged_history(), finished=True)
+        return model
+
+    def _merged_history(self):
+        """ Eval history of previous and current sessions."""
+        history = dict()
+        for data in set(self.history.keys()) | set(self._evals_log.keys()):
+            old, new = self.history.get(data, dict()), self._evals_log.get(data, dict())
+            history[data] = {metric: [float(i) for i in old.get(metric, [])] + [float(i) for i in new.get(metric, [])]
+                             for metric in list(old.keys()) + [m for m in new.keys() if m not in old]}
+        return history
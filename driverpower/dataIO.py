@@ -1,63 +1,88 @@
 """ Data input and output module for DriverPower.
 
-Input file types: X (tsv), y (tsv), functional scores (tsv), models (pkl)
+Input file types: X (tsv, hdf5 or feature store), y (tsv), functional scores (tsv),
+models (model bundle directory or legacy pkl)
+
+TSV tables (X, y and functional scores) are parsed with pyarrow on all cores if it is installed
+(``pip install driverpower[arrow]``), otherwise with pandas.
 
 """
 import logging
 import pickle
+import json
 import os
 import pkg_resources
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import RobustScaler
+from driverpower import __version__
+from driverpower.binindex import bin_codes, find_bins
 import warnings
 with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=FutureWarning)
     warnings.filterwarnings("ignore", category=DeprecationWarning)
     import xgboost as xgb
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pa_compute
+except ImportError:
+    pa = None
 
 
 logger = logging.getLogger('IO')
 
 
-def read_feature(path, use_features=None):
+def read_feature(path, use_features=None, use_bins=None, chunk_size=100000, dtype=None):
     """Read X (features) table in TSV format (or compressed).
 
     X must contain a column named 'binID' (key) and other columns will be treated as features.
+    Feature stores made by ``driverpower convert`` are read with column and row projection,
+    i.e., only requested features and bins are loaded.
 
     Args:
         path (str): Path to the file.
         use_features (list): List of features to load.
+        use_bins (np.array): List of binIDs to load. None for all bins.
+        chunk_size (int): Number of rows per chunk when filtering TSV by use_bins.
+        dtype (str): Data type of features, e.g., 'float32'. None to keep the type in file.
 
     Returns:
         pd.df: A panda DF indexed by binID.
 
     """
-    if path.lower().endswith(('.h5', '.hdf5')):
+    if is_feature_store(path):
+        # Columnar feature store
+        X = read_feature_store(path, use_features, use_bins, dtype)
+    elif path.lower().endswith(('.h5', '.hdf5')):
         # HDF5
         if use_features is not None:
             X = pd.read_hdf(path, 'X')
             X = X.loc[:, use_features]
         else:
             X = pd.read_hdf(path, 'X')
+        if use_bins is not None:
+            X = X.loc[X.index.isin(use_bins), :]
+        if dtype is not None:
+            X = X.astype(dtype, copy=False)
     elif path.lower().endswith(('.buffer')):
         # XGBoost binary
         X = xgb.DMatrix(path)
     else:
         # TSV or compressed TSV
-        if use_features is not None:
+        usecols = ['binID'] + list(use_features) if use_features is not None else None
+        X = read_tsv_arrow(path, usecols, _tsv_dtype(path, usecols, dtype), use_bins)
+        if X is None and use_bins is not None:
+            # filter rows chunk by chunk to avoid holding the full table
+            reader = pd.read_csv(path, sep='\t', header=0, index_col='binID',
+                                 usecols=usecols, chunksize=chunk_size, dtype=_tsv_dtype(path, usecols, dtype))
+            X = pd.concat([chunk.loc[chunk.index.isin(use_bins), :] for chunk in reader])
+        elif X is None:
             X = pd.read_csv(path, sep='\t', header=0, index_col='binID',
-                            usecols=['binID'] + use_features)
-        else:
-            X = pd.read_csv(path, sep='\t', header=0, index_col='binID')
+                            usecols=usecols, dtype=_tsv_dtype(path, usecols, dtype))
     if type(X) is pd.DataFrame:
-        # sanity check
-        assert len(X.index.values) == len(X.index.unique()), "binID in feature table is not unique."
-        na_count = X.isnull().sum()
-        if na_count.sum() > 0:
-            na_names = na_count.index.values[np.where(na_count>0)]
-            logger.warning('NA values found in features [{}]'.format(', '.join(na_names)))
-            logger.warning('Fill NA with 0')
-            X.fillna(0, inplace=True)
+        X = _check_feature(X)
         logger.info('Successfully load {} features for {} bins'.format(X.shape[1], X.shape[0]))
         return X
     elif type(X) is xgb.DMatrix:
@@ -66,6 +91,364 @@ def read_feature(path, use_features=None):
         return X
 
 
+def iter_feature(path, use_features=None, use_bins=None, chunk_size=100000, dtype=None):
+    """Read X (features) table in chunks of at most chunk_size bins.
+
+    Feature stores and TSV tables are streamed from disk;
+    HDF5 tables are loaded once and then split into chunks.
+
+    Args:
+        path (str): Path to the file.
+        use_features (list): List of features to load.
+        use_bins (np.array): List of binIDs to load. None for all bins.
+        chunk_size (int): Maximum number of bins per chunk.
+        dtype (str): Data type of features, e.g., 'float32'. None to keep the type in file.
+
+    Yields:
+        pd.df: A panda DF indexed by binID.
+
+    """
+    if is_feature_store(path):
+        meta, bins, codes, col_idx, use_features = _open_feature_store(path, use_features)
+        rows = _store_rows(bins, codes, use_bins)
+        for start in range(0, rows.shape[0], chunk_size):
+            X = _read_store_rows(path, meta, bins, col_idx, use_features, rows[start:start+chunk_size], dtype)
+            yield _check_feature(X)
+    elif path.lower().endswith(('.h5', '.hdf5')):
+        X = read_feature(path, use_features, use_bins, dtype=dtype)
+        for start in range(0, X.shape[0], chunk_size):
+            yield X.iloc[start:start+chunk_size, :]
+    else:
+        usecols = ['binID'] + list(use_features) if use_features is not None else None
+        reader = pd.read_csv(path, sep='\t', header=0, index_col='binID',
+                             usecols=usecols, chunksize=chunk_size, dtype=_tsv_dtype(path, usecols, dtype))
+        for X in reader:
+            if use_bins is not None:
+                X = X.loc[X.index.isin(use_bins), :]
+            if X.shape[0] > 0:
+                yield _check_feature(X)
+
+
+def read_tsv_arrow(path, usecols=None, dtype=None, use_bins=None):
+    """Read a TSV table (or compressed) indexed by binID with pyarrow.
+
+    Decompression and parsing run in threads. binID is read as string and
+    columns without a type in dtype are inferred as in pandas. Columns are in the file order.
+
+    Args:
+        path (str): Path to the file.
+        usecols (list): Columns to read, including binID. None for all columns.
+        dtype (dict): Data types of columns, e.g., {'CADD': np.float64}.
+        use_bins (np.array): List of binIDs to load. None for all bins.
+            Rows of other bins are removed block by block.
+
+    Returns:
+        pd.df: A panda DF indexed by binID. None if pyarrow is not installed or fails to parse the file.
+
+    """
+    if pa is None:
+        return None
+    header = pd.read_csv(path, sep='\t', header=0, nrows=0).columns
+    if usecols is not None:
+        missing = np.setdiff1d(usecols, header)
+        if missing.shape[0] > 0:
+            raise ValueError('Columns not found in {}: {}'.format(path, ', '.join(missing)))
+        header = header[header.isin(usecols)]
+    column_types = {name: pa.from_numpy_dtype(np.dtype(t)) for name, t in (dtype or dict()).items()}
+    column_types['binID'] = pa.string()
+    read_options = pa_csv.ReadOptions(use_threads=True)
+    parse_options = pa_csv.ParseOptions(delimiter='\t')
+    convert_options = pa_csv.ConvertOptions(include_columns=list(header), column_types=column_types)
+    try:
+        if use_bins is None:
+            table = pa_csv.read_csv(path, read_options, parse_options, convert_options)
+        else:
+            value_set = pa.array(np.asarray(use_bins).astype(str))
+            reader = pa_csv.open_csv(path, read_options, parse_options, convert_options)
+            batches = [batch.filter(pa_compute.is_in(batch.column('binID'), value_set=value_set))
+                       for batch in reader]
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        logger.warning('pyarrow failed to read {} ({}). Read with pandas'.format(path, e))
+        return None
+    return table.to_pandas().set_index('binID')
+
+
+def _tsv_dtype(path, usecols, dtype):
+    """Column types of features in a TSV for pd.read_csv; None to infer types."""
+    if dtype is None:
+        return None
+    names = usecols if usecols is not None else pd.read_csv(path, sep='\t', header=0, nrows=0).columns
+    return {name: dtype for name in names if name != 'binID'}
+
+
+def _check_feature(X):
+    """Sanity check of X; fill NA with 0."""
+    assert X.index.is_unique, "binID in feature table is not unique."
+    na_count = X.isnull().sum()
+    if na_count.sum() > 0:
+        na_names = na_count.index.values[np.where(na_count>0)]
+        logger.warning('NA values found in features [{}]'.format(', '.join(na_names)))
+        logger.warning('Fill NA with 0')
+        X.fillna(0, inplace=True)
+    return X
+
+
+def is_feature_store(path):
+    """Check whether path is a feature store made by ``driverpower convert``."""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def read_feature_store(path, use_features=None, use_bins=None, dtype=None):
+    """Read X (features) from a columnar feature store.
+
+    The store is a directory with one memory-mappable .npy file per feature,
+    a binID index (binID.npy), binID codes (binID.codes.npy, see binindex.bin_codes)
+    and meta data (meta.json).
+    Only the requested columns and rows are read from disk.
+
+    Args:
+        path (str): Path to the store directory.
+        use_features (list): List of features to load. None for all features.
+        use_bins (np.array): List of binIDs to load. None for all bins.
+        dtype (str): Data type of features. None to use the type of the store.
+
+    Returns:
+        pd.df: A panda DF indexed by binID.
+
+    """
+    meta, bins, codes, col_idx, use_features = _open_feature_store(path, use_features)
+    rows = _store_rows(bins, codes, use_bins)
+    return _read_store_rows(path, meta, bins, col_idx, use_features, rows, dtype)
+
+
+def _open_feature_store(path, use_features=None):
+    """Load meta data and binID index of a feature store; locate requested features."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    bins = np.load(os.path.join(path, 'binID.npy'))
+    codes_path = os.path.join(path, 'binID.codes.npy')
+    if os.path.isfile(codes_path):
+        codes = np.load(codes_path)
+    else:
+        # stores converted before binID codes; the store is not modified,
+        # so its content hash (see cache.hash_path) is stable
+        codes = bin_codes(bins)[1]
+    features = pd.Index(meta['features'])
+    use_features = features.values if use_features is None else np.asarray(use_features)
+    col_idx = features.get_indexer(use_features)
+    if np.any(col_idx < 0):
+        raise ValueError('Features not found in feature store: {}'.format(
+            ', '.join(use_features[col_idx < 0])))
+    return meta, bins, codes, col_idx, use_features
+
+
+def _store_rows(bins, codes, use_bins=None):
+    """Row positions of use_bins in a feature store, in storage order."""
+    if use_bins is None:
+        return np.arange(bins.shape[0])
+    rows = find_bins(bins, use_bins, codes)
+    # keep rows in storage order for sequential reads
+    return np.sort(rows[rows >= 0])
+
+
+def _read_store_rows(path, meta, bins, col_idx, use_features, rows, dtype=None):
+    """Read selected rows and columns of a feature store into a DF, cast to dtype."""
+    # Fortran order so that each column is contiguous and the DF is built without copy
+    X = np.empty((rows.shape[0], col_idx.shape[0]), dtype=meta['dtype'] if dtype is None else dtype, order='F')
+    for j, ix in enumerate(col_idx):
+        col = np.load(_store_column_path(path, ix), mmap_mode='r')
+        X[:, j] = col[rows]
+        del col
+    X = pd.DataFrame(X, index=pd.Index(bins[rows], name='binID'), columns=use_features)
+    return X
+
+
+def open_store_matrix(path, use_features=None, use_bins=None, dtype=None):
+    """Open X (features) in a feature store without reading it.
+
+    Args:
+        path (str): Path to the store directory.
+        use_features (list): List of features to use. None for all features.
+        use_bins (np.array): List of binIDs to use. None for all bins.
+        dtype (str): Data type of row blocks. None to use the type of the store.
+
+    Returns:
+        StoreMatrix: matrix of features, read by row blocks.
+
+    """
+    meta, bins, codes, col_idx, use_features = _open_feature_store(path, use_features)
+    rows = _store_rows(bins, codes, use_bins)
+    return StoreMatrix(path, bins, rows, col_idx, use_features, meta['dtype'] if dtype is None else dtype)
+
+
+class StoreMatrix(object):
+    """ Rows and columns of a feature store as a matrix on memory maps.
+
+    Row slices (X[start:end]) are read as np.array from the column files, so the
+    matrix is never held in memory. index and columns are binIDs and features as in pd.df.
+
+    """
+    def __init__(self, path, bins, rows, col_idx, features, dtype):
+        self.path = path
+        self.rows = rows
+        self.col_idx = col_idx
+        self.dtype = np.dtype(dtype)
+        self.index = pd.Index(bins[rows], name='binID')
+        self.columns = pd.Index(features)
+        self._bins = bins
+        self._cols = [np.load(_store_column_path(path, ix), mmap_mode='r') for ix in col_idx]
+
+    @property
+    def shape(self):
+        return self.rows.shape[0], self.col_idx.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('StoreMatrix only supports row slices')
+        rows = self.rows[key]
+        block = np.empty((rows.shape[0], len(self._cols)), dtype=self.dtype)
+        for j, col in enumerate(self._cols):
+            block[:, j] = col[rows]
+        return block
+
+    def column(self, j):
+        """ Column j as np.array."""
+        return self._cols[j][self.rows].astype(self.dtype)
+
+    def take(self, rows, cols):
+        """ StoreMatrix of rows and columns (positions in this matrix)."""
+        return StoreMatrix(self.path, self._bins, self.rows[rows], self.col_idx[cols],
+                           self.columns.values[cols], self.dtype)
+
+
+def save_feature_store(X_path, out_path, chunk_size=100000, dtype='float64'):
+    """Convert a feature table (TSV or HDF5) to a columnar feature store.
+
+    TSV tables are converted chunk by chunk, so the full table is never held in memory.
+
+    Args:
+        X_path (str): Path to the feature table.
+        out_path (str): Path to the output store directory.
+        chunk_size (int): Number of rows per chunk.
+        dtype (str): Data type of the store, 'float64' or 'float32' (half the size).
+
+    Returns:
+
+    """
+    if X_path.lower().endswith(('.h5', '.hdf5')):
+        X = pd.read_hdf(X_path, 'X')
+        bins = X.index.values
+        features = X.columns.values
+        chunks = [X]
+    else:
+        features = pd.read_csv(X_path, sep='\t', header=0, index_col='binID', nrows=0).columns.values
+        bins = pd.read_csv(X_path, sep='\t', header=0, usecols=['binID']).binID.values
+        chunks = pd.read_csv(X_path, sep='\t', header=0, index_col='binID', chunksize=chunk_size)
+    assert pd.Index(bins).is_unique, "binID in feature table is not unique."
+    write_feature_store(out_path, bins, features, chunks, dtype)
+
+
+def write_feature_store(out_path, bins, features, chunks, dtype=np.float64):
+    """Write feature chunks to a columnar feature store.
+
+    Args:
+        out_path (str): Path to the output store directory.
+        bins (np.array): binIDs of all rows.
+        features (np.array): feature names.
+        chunks (iterable): pd.df of consecutive rows, columns in the order of features.
+        dtype (np.dtype): data type of the store.
+
+    Returns:
+
+    """
+    os.makedirs(os.path.join(out_path, 'X'), exist_ok=True)
+    np.save(os.path.join(out_path, 'binID.npy'), np.asarray(bins).astype(np.str_))
+    np.save(os.path.join(out_path, 'binID.codes.npy'), bin_codes(bins)[1])
+    # allocate one file per feature
+    for ix in range(features.shape[0]):
+        col = np.lib.format.open_memmap(_store_column_path(out_path, ix), mode='w+',
+                                        dtype=dtype, shape=(bins.shape[0],))
+        del col
+    # fill chunk by chunk
+    start = 0
+    for chunk in chunks:
+        end = start + chunk.shape[0]
+        values = chunk.values
+        for ix in range(features.shape[0]):
+            col = np.load(_store_column_path(out_path, ix), mmap_mode='r+')
+            col[start:end] = values[:, ix]
+            del col
+        logger.info('Converted {}/{} bins'.format(end, bins.shape[0]))
+        start = end
+    meta = {'format': 'DriverPower feature store',
+            'version': 1,
+            'n_bins': int(bins.shape[0]),
+            'dtype': np.dtype(dtype).name,
+            'features': features.tolist()}
+    with open(os.path.join(out_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    logger.info('Successfully save {} features for {} bins to {}'.format(features.shape[0], bins.shape[0], out_path))
+
+
+def _store_column_path(path, ix):
+    return os.path.join(path, 'X', '{:06d}.npy'.format(ix))
+
+
+def read_mut_matrix(path):
+    """Read a mutation matrix saved by save_mut_matrix.
+
+    Args:
+        path (str): Path to the mutation matrix directory.
+
+    Returns:
+        sparse.csr_matrix: number of mutations per bin (row) and donor (column).
+        np.array: binIDs of rows.
+        np.array: effective length of rows.
+        np.array: donor IDs of columns.
+
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    assert meta.get('format') == 'DriverPower mutation matrix', '{} is not a mutation matrix'.format(path)
+    mat = sparse.load_npz(os.path.join(path, 'counts.npz')).tocsr()
+    bins = pd.read_csv(os.path.join(path, 'bins.tsv'), sep='\t', header=0, dtype={'binID': str})
+    donors = pd.read_csv(os.path.join(path, 'donors.txt'), sep='\t', header=None, dtype=str)[0].values
+    assert mat.shape == (bins.shape[0], donors.shape[0]), 'Mutation matrix shape does not match its index files'
+    logger.info('Successfully load mutation matrix of {} bins and {} donors'.format(mat.shape[0], mat.shape[1]))
+    return mat, bins.binID.values, bins.length.values, donors
+
+
+def save_mut_matrix(path, mat, bins, length, donors):
+    """Save a sparse bins x donors mutation matrix as a directory.
+
+    The directory contains counts.npz (CSR matrix), bins.tsv (binID and length of rows),
+    donors.txt (donor IDs of columns) and meta.json.
+
+    Args:
+        path (str): Path to the output directory.
+        mat (sparse.csr_matrix): number of mutations per bin (row) and donor (column).
+        bins (np.array): binIDs of rows.
+        length (np.array): effective length of rows.
+        donors (np.array): donor IDs of columns.
+
+    Returns:
+
+    """
+    os.makedirs(path, exist_ok=True)
+    sparse.save_npz(os.path.join(path, 'counts.npz'), mat.tocsr())
+    pd.DataFrame({'binID': bins, 'length': length}, columns=['binID', 'length']).to_csv(
+        os.path.join(path, 'bins.tsv'), sep='\t', index=False)
+    pd.Series(donors).to_csv(os.path.join(path, 'donors.txt'), sep='\t', index=False, header=False)
+    meta = {'format': 'DriverPower mutation matrix',
+            'version': 1,
+            'n_bins': int(mat.shape[0]),
+            'n_donors': int(mat.shape[1])}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    logger.info('Mutation matrix saved to {}'.format(path))
+
+
 def read_response(path):
     """Read y (response) table in TSV format.
     
@@ -78,13 +461,45 @@ def read_response(path):
         pd.df: A panda DF indexed by binID.
         
     """
-    y = pd.read_csv(path, sep='\t', header=0, index_col='binID',
-                    usecols=['binID', 'length', 'nMut', 'nSample', 'N'])
+    usecols = ['binID', 'length', 'nMut', 'nSample', 'N']
+    y = read_tsv_arrow(path, usecols)
+    if y is None:
+        y = pd.read_csv(path, sep='\t', header=0, index_col='binID', usecols=usecols)
     # sanity check
-    assert len(y.index.values) == len(y.index.unique()), "binID in response table is not unique."
+    assert y.index.is_unique, "binID in response table is not unique."
     return y
 
 
+def read_response_list(paths):
+    """Expand paths to response tables and manifests to a list of cohorts.
+
+    A manifest is a TSV with two columns: name and path (relative to the manifest).
+    Other files are response tables named by their file names.
+
+    Args:
+        paths (list): List of paths to response tables or manifests.
+
+    Returns:
+        list: (name, path) per cohort.
+
+    """
+    cohorts = []
+    for path in paths:
+        header = pd.read_csv(path, sep='\t', header=0, nrows=0).columns.tolist()
+        if header == ['name', 'path']:
+            manifest = pd.read_csv(path, sep='\t', header=0, dtype=str)
+            root = os.path.dirname(path)
+            cohorts += [(name, os.path.join(root, p)) for name, p in zip(manifest.name, manifest.path)]
+        else:
+            name = os.path.basename(path)
+            for ext in ('.gz', '.bz2', '.tsv', '.txt'):
+                name = name[:-len(ext)] if name.endswith(ext) else name
+            cohorts.append((name, path))
+    names = [i[0] for i in cohorts]
+    assert len(names) == len(set(names)), "Cohort names of response tables are not unique."
+    return cohorts
+
+
 def read_fs(path, fs_cut):
     """Read functional scores table in TSV format.
     
@@ -98,10 +513,12 @@ def read_fs(path, fs_cut):
         pd.df: A panda DF indexed by binID
          
     """
-    fs = pd.read_csv(path, sep='\t', header=0, index_col='binID',
-                     usecols=['binID'] + list(fs_cut.keys()))
+    usecols = ['binID'] + list(fs_cut.keys())
+    fs = read_tsv_arrow(path, usecols, {i: np.float64 for i in fs_cut.keys()})
+    if fs is None:
+        fs = pd.read_csv(path, sep='\t', header=0, index_col='binID', usecols=usecols)
     # sanity check
-    assert len(fs.index.values) == len(fs.index.unique()), "binID in functional score table is not unique."
+    assert fs.index.is_unique, "binID in functional score table is not unique."
     return fs
 
 
@@ -171,16 +588,155 @@ def save_prediction(ypred, y, project_name, out_dir, model_name):
     return
 
 
+# Version of the model bundle layout written by save_model
+MODEL_BUNDLE_VERSION = 1
+
+
 def read_model(path):
-    with open(path, 'rb') as f:
-        model = pickle.load(f)
+    """ Load a model bundle (directory) or a legacy model pickle.
+
+    Bundles are loaded lazily: only meta data are read here and
+    GBM boosters are read from disk when they are first used.
+
+    Args:
+        path (str): path to the model bundle or pickle.
+
+    Returns:
+        dict: model info.
+
+    """
+    if not os.path.isdir(path):
+        # legacy pickle
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        return model
+    with open(os.path.join(path, 'meta.json')) as f:
+        model = json.load(f)
+    if model.get('version', 0) > MODEL_BUNDLE_VERSION:
+        raise ValueError('Model bundle version {} is not supported by DriverPower v{}. '
+                         'Please upgrade DriverPower.'.format(model['version'], __version__))
+    model['feature_names'] = np.array(model['feature_names'])
+    if model['model_name'] == 'GBM':
+        model['model'] = _LazyBoosters(path, model['kfold'])
+    else:
+        glm = np.load(os.path.join(path, 'glm.npz'))
+        # GLM coefficients, intercept last
+        model['coef'] = glm['coef']
+        scaler = RobustScaler(copy=False)
+        scaler.center_ = glm['scaler_center']
+        scaler.scale_ = glm['scaler_scale']
+        model['scaler'] = scaler
+        model['use_features'] = np.array(model['use_features'])
+        if 'use_index' in glm:
+            model['use_index'] = glm['use_index']
     return model
 
 
+def read_folds(path):
+    """ Read the fold of each training bin of a GBM model bundle.
+
+    Args:
+        path (str): path to the model bundle.
+
+    Returns:
+        tuple: (binIDs, folds). None if folds are not saved (e.g., legacy models).
+
+    """
+    fold_path = os.path.join(path, 'folds.npz')
+    if not os.path.isfile(fold_path):
+        return None
+    folds = np.load(fold_path)
+    return folds['binID'], folds['fold']
+
+
+def save_folds(path, bins, fold):
+    """ Save the fold of each training bin to folds.npz in path.
+
+    Args:
+        path (str): path to the model bundle (or GBM checkpoint).
+        bins (np.array): binIDs of training rows.
+        fold (np.array): fold of each row.
+
+    Returns:
+
+    """
+    tmp_path = os.path.join(path, 'folds.tmp.npz')
+    np.savez(tmp_path, binID=np.asarray(bins).astype(np.str_), fold=np.asarray(fold, dtype=np.int32))
+    os.replace(tmp_path, os.path.join(path, 'folds.npz'))
+
+
+class _LazyBoosters(dict):
+    """ GBM boosters of a model bundle keyed by fold, read from disk on first access."""
+    def __init__(self, path, kfold):
+        super(_LazyBoosters, self).__init__()
+        self.path = path
+        self.kfold = kfold
+
+    def __missing__(self, k):
+        if k not in range(1, self.kfold+1):
+            raise KeyError(k)
+        bst = xgb.Booster(model_file=os.path.join(self.path, 'fold{}.json'.format(k)))
+        self[k] = bst
+        return bst
+
+
 def save_model(model, project_name, out_dir, model_name):
-    path = os.path.join(out_dir, '{}.{}.model.pkl'.format(project_name, model_name))
-    with open(path, 'wb') as f:
-        pickle.dump(model, f)
+    """ Save model info as a model bundle directory.
+
+    The bundle contains meta.json (meta data), fold[k].json (GBM boosters in xgboost JSON format)
+    and folds.npz (fold of each training bin), or glm.npz (GLM coefficients, scaler parameters
+    and indices of used features in feature_names).
+
+    Args:
+        model (dict): model info from run_bmr.
+        project_name (str): name of the project, prefix of the output directory.
+        out_dir (str): output directory.
+        model_name (str): 'Binomial', 'NegativeBinomial' or 'GBM'.
+
+    Returns:
+        str: path to the model bundle.
+
+    """
+    path = os.path.join(out_dir, '{}.{}.model'.format(project_name, model_name))
+    os.makedirs(path, exist_ok=True)
+    meta = {'format': 'DriverPower model bundle',
+            'version': MODEL_BUNDLE_VERSION,
+            'driverpower_version': __version__,
+            'model_name': model['model_name'],
+            'pval_dispersion': float(model['pval_dispersion']),
+            'theta': float(model['theta']),
+            'feature_names': [str(i) for i in model['feature_names']],
+            'project_name': model['project_name']}
+    if model_name == 'GBM':
+        meta['kfold'] = int(model['kfold'])
+        meta['params'] = model['params']
+        meta['model_dir'] = model['model_dir']
+        for k, bst in model['model'].items():
+            bst.save_model(os.path.join(path, 'fold{}.json'.format(k)))
+        if 'folds' in model:
+            save_folds(path, *model['folds'])
+    else:
+        meta['use_features'] = [str(i) for i in model['use_features']]
+        np.savez(os.path.join(path, 'glm.npz'),
+                 coef=np.asarray(model['coef']),
+                 use_index=np.flatnonzero(np.isin(model['feature_names'], model['use_features'])),
+                 scaler_center=model['scaler'].center_,
+                 scaler_scale=model['scaler'].scale_)
+    # numpy values (e.g., in --gbmParam pickles) are converted to Python types
+    meta = json.dumps(meta, indent=1, default=_json_default)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        f.write(meta)
+    logger.info('Model saved to {}'.format(path))
+    return path
+
+
+def _json_default(obj):
+    """ JSON encoding of numpy scalars and arrays."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
 
 
 def save_result(y, project_name, out_dir):
@@ -0,0 +1,444 @@
+""" Make features for DriverPower.
+
+This module supports:
+1. Nucleotide content features from a 2bit reference genome
+2. Coverage features from BED and bedGraph tracks
+3. Collapse of per-interval feature tables by binID
+
+"""
+import logging
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from driverpower.interval import read_bed, split_chrom, merge_intervals, intersect_merged
+from driverpower.dataIO import write_feature_store
+
+
+logger = logging.getLogger('FEATURE')
+# Data shared with chromosome workers
+_NUC_DATA = dict()
+# Data shared with track workers
+_TRACK_DATA = dict()
+# Bases in the order of 2bit codes
+TWOBIT_BASES = 'TCAG'
+# 32 trinucleotide contexts (middle base C or T), each with its reverse complement
+CONTEXTS = ['ACA', 'ACC', 'ACG', 'ACT', 'ATA', 'ATC', 'ATG', 'ATT',
+            'CCA', 'CCC', 'CCG', 'CCT', 'CTA', 'CTC', 'CTG', 'CTT',
+            'GCA', 'GCC', 'GCG', 'GCT', 'GTA', 'GTC', 'GTG', 'GTT',
+            'TCA', 'TCC', 'TCG', 'TCT', 'TTA', 'TTC', 'TTG', 'TTT']
+# 2-mers with the 5' or 3' base of the context removed. CC3p and TT3p are the same as CC5p and TT5p
+TWO_MERS_5P = ['TA', 'TC', 'TG', 'TT', 'CA', 'CC', 'CG', 'CT']
+TWO_MERS_3P = ['AT', 'CT', 'GT', 'AC', 'GC', 'TC']
+
+
+def make_nuc_features(ele_path, genome_path, out_path=None, callable_path=None, n_jobs=1):
+    """ Make nucleotide content features of elements.
+
+    Features are the percentages of 32 trinucleotide contexts and 14 2-mers in
+    whitelisted parts of elements, extended by 1 bp on both sides.
+
+    Args:
+        ele_path (str): path to elements (chrom, start, end, binID), no header.
+        genome_path (str): path to the reference genome in UCSC 2bit format.
+        out_path (str): path to the output feature table. None for no output.
+        callable_path (str): path to whitelisted regions (chrom, start, end), no header.
+            None to use whole elements.
+        n_jobs (int): number of chromosomes counted in parallel.
+
+    Returns:
+        pd.df: 46 features indexed by binID.
+
+    """
+    cg = count_context(ele_path, genome_path, callable_path, n_jobs)
+    nuc = nuc_features(cg)
+    if out_path is not None:
+        nuc.to_csv(out_path, sep='\t')
+        logger.info('Nucleotide features saved to {}'.format(out_path))
+    return nuc
+
+
+def nuc_features(cg):
+    """ Percentages of trinucleotide contexts and 2-mers.
+
+    Args:
+        cg (pd.df): counts of the 32 CONTEXTS, indexed by binID.
+
+    Returns:
+        pd.df: 32 context and 14 2-mer percentages indexed by binID. Bins without counts are 0.
+
+    """
+    counts = cg.loc[:, CONTEXTS].values.astype(np.float64)
+    total = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = counts.dot(_feature_matrix()) / total[:, np.newaxis] * 100
+    pct[total == 0, :] = 0
+    columns = CONTEXTS + [i + '5p' for i in TWO_MERS_5P] + [i + '3p' for i in TWO_MERS_3P]
+    return pd.DataFrame(pct, index=cg.index, columns=columns)
+
+
+def count_context(ele_path, genome_path, callable_path=None, n_jobs=1):
+    """ Count trinucleotide contexts in elements.
+
+    As in script/make_features/generate_cg.sh, elements are intersected with whitelisted
+    regions, and each piece is extended by 1 bp on both sides within the chromosome.
+    A trinucleotide and its reverse complement are counted as one context.
+    Trinucleotides with N are not counted. Chromosomes are counted in parallel.
+
+    Args:
+        ele_path (str): path to elements (chrom, start, end, binID), no header.
+        genome_path (str): path to the reference genome in UCSC 2bit format.
+        callable_path (str): path to whitelisted regions. None to use whole elements.
+        n_jobs (int): number of worker processes.
+
+    Returns:
+        pd.df: counts of the 32 CONTEXTS indexed by binID.
+
+    """
+    pieces, bins = read_pieces(ele_path, callable_path)
+    index = read_twobit_index(genome_path)
+    for chrom in list(pieces.keys()):
+        if chrom not in index:
+            logger.warning('{} is not in the genome. Skipped'.format(chrom))
+            del pieces[chrom]
+            continue
+        start, end, p_bin = pieces[chrom]
+        # extend 1 bp for contexts at both ends
+        start = np.maximum(start - 1, 0)
+        end = np.minimum(end + 1, index[chrom]['size'])
+        pieces[chrom] = (start, end, p_bin)
+    _NUC_DATA.update(genome_path=genome_path, index=index, pieces=pieces)
+    chroms = sorted(pieces.keys(), key=lambda c: -index[c]['size'])  # long chromosomes first
+    n_jobs = max(1, min(n_jobs, len(chroms)))
+    try:
+        if n_jobs == 1:
+            res = [_count_chrom(c) for c in chroms]
+        else:
+            logger.info('Counting {} chromosomes in {} processes'.format(len(chroms), n_jobs))
+            with multiprocessing.get_context('fork').Pool(n_jobs) as pool:
+                res = pool.map(_count_chrom, chroms, chunksize=1)
+    finally:
+        _NUC_DATA.clear()
+    counts = np.zeros((bins.shape[0], 32), dtype=np.int64)
+    for chrom_bin, chrom_counts in res:
+        counts[chrom_bin] += chrom_counts
+    return pd.DataFrame(counts, index=pd.Index(bins, name='binID'), columns=CONTEXTS)
+
+
+def _count_chrom(chrom, block_size=1 << 24):
+    """ Count trinucleotide contexts per bin on a chromosome. Data are read from _NUC_DATA.
+
+    Returns:
+        np.array: bin codes.
+        np.array: counts of the 32 CONTEXTS per bin.
+
+    """
+    start, end, p_bin = _NUC_DATA['pieces'][chrom]
+    counts = np.zeros((start.shape[0], 64), dtype=np.int64)
+    if start.shape[0] == 0:
+        return p_bin, np.zeros((0, 32), dtype=np.int64)
+    lo, hi = start.min(), end.max()
+    seq = read_twobit(_NUC_DATA['genome_path'], chrom, lo, hi, _NUC_DATA['index'])
+    # trinucleotide code at each position; 64 if any base is N
+    tri = (seq[:-2] << 4) | (seq[1:-1] << 2) | seq[2:]
+    tri[(seq[:-2] > 3) | (seq[1:-1] > 3) | (seq[2:] > 3)] = 64
+    # trinucleotides start within [start, end-2) of each piece
+    n_tri = np.maximum(end - start - 2, 0)
+    csum = np.cumsum(n_tri)
+    # split pieces into blocks of about block_size positions
+    edges = np.unique(np.r_[0, np.searchsorted(csum, np.arange(block_size, csum[-1], block_size)), start.shape[0]])
+    for first, last in zip(edges[:-1], edges[1:]):
+        ct = n_tri[first:last]
+        piece = np.repeat(np.arange(last - first), ct)
+        pos = np.repeat(start[first:last] - lo - (np.cumsum(ct) - ct), ct) + np.arange(piece.shape[0])
+        key = piece * 65 + tri[pos]
+        counts[first:last] = np.bincount(key, minlength=(last - first) * 65).reshape(-1, 65)[:, :64]
+    logger.info('Counted trinucleotides of {} pieces on {}'.format(start.shape[0], chrom))
+    # trinucleotides to contexts, summed per bin
+    chrom_bin, inverse = np.unique(p_bin, return_inverse=True)
+    chrom_counts = np.zeros((chrom_bin.shape[0], 32), dtype=np.int64)
+    np.add.at(chrom_counts, inverse, counts.dot(_tri_context_matrix().astype(np.int64)))
+    return chrom_bin, chrom_counts
+
+
+def make_track_features(ele_path, track_paths, out_path=None, callable_path=None, n_jobs=1):
+    """ Make coverage features of elements from BED and bedGraph tracks.
+
+    Features are length-weighted mean coverage per binID, i.e., the sum of
+    signal x overlapping bp over the total length of (whitelisted) elements.
+    Bases not in a track count as 0. BED tracks (*.bed, *.narrowPeak) have signal 1 in
+    merged intervals, so the feature is the fraction of covered bp as in beds2cv.sh.
+    bedGraph tracks (*.bedGraph, *.bg) use the value in column 4 as the signal.
+    Feature names are file names before the first ".". Tracks are processed in parallel.
+
+    Args:
+        ele_path (str): path to elements (chrom, start, end, binID), no header.
+        track_paths (list): paths to BED or bedGraph tracks (can be compressed).
+        out_path (str): path to the output feature table. None for no output.
+        callable_path (str): path to whitelisted regions (chrom, start, end), no header.
+            None to use whole elements.
+        n_jobs (int): number of worker processes.
+
+    Returns:
+        pd.df: one feature per track indexed by binID.
+
+    """
+    names = [track_name(i) for i in track_paths]
+    dup = pd.Index(names)[pd.Index(names).duplicated()].unique()
+    assert len(dup) == 0, 'Duplicated track names: {}'.format(', '.join(dup))
+    pieces, bins = read_pieces(ele_path, callable_path)
+    # total length per bin, shared by all tracks
+    length = np.zeros(bins.shape[0])
+    for start, end, p_bin in pieces.values():
+        length += np.bincount(p_bin, weights=end - start, minlength=bins.shape[0])
+    _TRACK_DATA.update(pieces=pieces, n_bins=bins.shape[0])
+    n_jobs = max(1, min(n_jobs, len(track_paths)))
+    try:
+        if n_jobs == 1:
+            res = [_track_signal(i) for i in track_paths]
+        else:
+            logger.info('Processing {} tracks in {} processes'.format(len(track_paths), n_jobs))
+            with multiprocessing.get_context('fork').Pool(n_jobs) as pool:
+                res = pool.map(_track_signal, track_paths, chunksize=1)
+    finally:
+        _TRACK_DATA.clear()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = np.column_stack(res) / length[:, np.newaxis] if len(res) > 0 else np.zeros((bins.shape[0], 0))
+    cv[length == 0, :] = 0
+    cv = pd.DataFrame(cv, index=pd.Index(bins, name='binID'), columns=names)
+    if out_path is not None:
+        cv.to_csv(out_path, sep='\t')
+        logger.info('Track features saved to {}'.format(out_path))
+    return cv
+
+
+def track_name(path):
+    """ Feature name of a track: the file name before the first "."."""
+    return os.path.basename(path).split('.')[0]
+
+
+def _track_signal(path):
+    """ Sum of signal x overlapping bp per bin for one track. Elements are read from _TRACK_DATA.
+
+    Track intervals are sorted per chromosome, and the signal over a piece is the difference
+    of cumulative signal at the piece ends, found by binary search.
+
+    Returns:
+        np.array: signal per bin code.
+
+    """
+    is_bedgraph = any(i in os.path.basename(path).lower().split('.') for i in ('bedgraph', 'bg'))
+    if is_bedgraph:
+        track = read_bed(path, [0, 1, 2, 3], ['chrom', 'start', 'end', 'value'])
+    else:
+        track = read_bed(path, [0, 1, 2], ['chrom', 'start', 'end'])
+    signal = np.zeros(_TRACK_DATA['n_bins'])
+    for chrom, ix in split_chrom(track.chrom.values).items():
+        if chrom not in _TRACK_DATA['pieces']:
+            continue
+        if is_bedgraph:
+            order = np.argsort(track.start.values[ix], kind='mergesort')
+            t_start, t_end = track.start.values[ix][order], track.end.values[ix][order]
+            value = track.value.values[ix][order]
+            assert (t_start[1:] >= t_end[:-1]).all(), 'Overlapping intervals on {} in {}'.format(chrom, path)
+        else:
+            t_start, t_end = merge_intervals(track.start.values[ix], track.end.values[ix])
+            value = np.ones(t_start.shape[0])
+        start, end, p_bin = _TRACK_DATA['pieces'][chrom]
+        cum = np.r_[0, np.cumsum(value * (t_end - t_start))]
+        piece_signal = _cum_signal(end, t_start, t_end, value, cum) - \
+            _cum_signal(start, t_start, t_end, value, cum)
+        signal += np.bincount(p_bin, weights=piece_signal, minlength=signal.shape[0])
+    logger.info('Processed {}'.format(path))
+    return signal
+
+
+def _cum_signal(pos, t_start, t_end, value, cum):
+    """ Signal x bp of sorted, non-overlapping track intervals before each position."""
+    # intervals before i start at or before pos; only interval i-1 can extend past pos
+    i = np.searchsorted(t_start, pos, side='right')
+    last = np.maximum(i - 1, 0)
+    return cum[i] - np.where(i > 0, value[last] * np.maximum(t_end[last] - pos, 0), 0)
+
+
+def read_pieces(ele_path, callable_path=None):
+    """ Read elements and keep their whitelisted pieces.
+
+    Args:
+        ele_path (str): path to elements (chrom, start, end, binID), no header.
+        callable_path (str): path to whitelisted regions (chrom, start, end), no header.
+            None to use whole elements.
+
+    Returns:
+        dict: {chrom: (start, end, bin)}; bin is the code in bins.
+        np.array: sorted binIDs.
+
+    """
+    ele = read_bed(ele_path, [0, 1, 2, 3], ['chrom', 'start', 'end', 'binID'])
+    bins, ele_bin = np.unique(ele.binID.values.astype(str), return_inverse=True)
+    whitelist = None
+    if callable_path is not None:
+        whitelist = read_bed(callable_path, [0, 1, 2], ['chrom', 'start', 'end'])
+        wl_ix = split_chrom(whitelist.chrom.values)
+    pieces = dict()
+    for chrom, ix in split_chrom(ele.chrom.values).items():
+        start, end, p_bin = ele.start.values[ix], ele.end.values[ix], ele_bin[ix]
+        if whitelist is not None:
+            if chrom not in wl_ix:
+                continue
+            m_start, m_end = merge_intervals(whitelist.start.values[wl_ix[chrom]],
+                                             whitelist.end.values[wl_ix[chrom]])
+            q_ix, start, end = intersect_merged(start, end, m_start, m_end)
+            p_bin = p_bin[q_ix]
+        pieces[chrom] = (start, end, p_bin)
+    return pieces, bins
+
+
+def collapse_features(in_path, out_path=None, store_path=None, chunk_size=1000000):
+    """ Sum a per-interval feature table by binID, reading it in chunks.
+
+    Same as ``pivot_table(index='binID', aggfunc=sum)``: rows are sorted by binID,
+    columns are sorted by name and missing values count as 0.
+    Rows are summed into one accumulator row per binID, so memory scales with
+    the number of bins and features instead of input rows.
+
+    Args:
+        in_path (str): path to the feature table (TSV with header), one row per interval.
+        out_path (str): path to the output feature table (TSV). None for no output.
+        store_path (str): path to the output feature store directory. None for no output.
+        chunk_size (int): number of rows per chunk.
+
+    Returns:
+        pd.df: features indexed by binID.
+
+    """
+    header = pd.read_csv(in_path, sep='\t', header=0, nrows=0).columns
+    features = np.sort(header[header != 'binID'].values)
+    rows = dict()  # binID to accumulator row
+    acc = np.zeros((1024, features.shape[0]))
+    is_int = np.ones(features.shape[0], dtype=bool)
+    ct = 0
+    for chunk in pd.read_csv(in_path, sep='\t', header=0, chunksize=chunk_size, dtype={'binID': str}):
+        ct += chunk.shape[0]
+        # sum within the chunk first
+        chunk = chunk.groupby('binID', sort=False)[list(features)].sum()
+        is_int &= np.array([np.issubdtype(i, np.integer) for i in chunk.dtypes])
+        ix = np.array([rows.setdefault(i, len(rows)) for i in chunk.index.values], dtype=np.int64)
+        if len(rows) > acc.shape[0]:
+            acc = np.r_[acc, np.zeros((max(len(rows), 2 * acc.shape[0]) - acc.shape[0], acc.shape[1]))]
+        acc[ix] += chunk.values
+        logger.info('Collapsed {} rows to {} bins'.format(ct, len(rows)))
+    bins = np.array(list(rows.keys()), dtype=str)
+    order = np.argsort(bins, kind='mergesort')
+    cv = pd.DataFrame(acc[:len(rows)][order], index=pd.Index(bins[order], name='binID'), columns=features)
+    if is_int.any():
+        cv = cv.astype({i: np.int64 for i in features[is_int]})
+    if out_path is not None:
+        cv.to_csv(out_path, sep='\t')
+        logger.info('Collapsed features saved to {}'.format(out_path))
+    if store_path is not None:
+        write_feature_store(store_path, cv.index.values, features, [cv])
+    return cv
+
+
+def read_twobit_index(path):
+    """ Read the sequence index of a UCSC 2bit file.
+
+    Args:
+        path (str): path to the 2bit file.
+
+    Returns:
+        dict: {chrom: {'size', 'offset', 'n_starts', 'n_sizes'}}. offset is the byte offset of packed bases.
+
+    """
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    endian = _twobit_endian(mm)
+    version = _read_uint32(mm, 4, endian)
+    n_seq = _read_uint32(mm, 8, endian)
+    pos = 16
+    offsets = dict()
+    for i in range(n_seq):
+        name_size = int(mm[pos])
+        name = mm[pos+1:pos+1+name_size].tobytes().decode()
+        pos += 1 + name_size
+        if version == 1:
+            offsets[name] = int(mm[pos:pos+8].view(endian + 'u8')[0])
+            pos += 8
+        else:
+            offsets[name] = _read_uint32(mm, pos, endian)
+            pos += 4
+    index = dict()
+    for name, pos in offsets.items():
+        size = _read_uint32(mm, pos, endian)
+        n_block = _read_uint32(mm, pos + 4, endian)
+        n_starts = mm[pos+8:pos+8+4*n_block].view(endian + 'u4').astype(np.int64)
+        n_sizes = mm[pos+8+4*n_block:pos+8+8*n_block].view(endian + 'u4').astype(np.int64)
+        pos += 8 + 8 * n_block
+        # skip mask (lower case) blocks and reserved field
+        n_mask = _read_uint32(mm, pos, endian)
+        pos += 4 + 8 * n_mask + 4
+        index[name] = {'size': size, 'offset': pos, 'n_starts': n_starts, 'n_sizes': n_sizes}
+    del mm
+    return index
+
+
+def read_twobit(path, chrom, start, end, index):
+    """ Read bases of a region from a UCSC 2bit file via memory map.
+
+    Args:
+        path (str): path to the 2bit file.
+        chrom (str): chromosome.
+        start (int): 0-based start.
+        end (int): end (exclusive).
+        index (dict): index from read_twobit_index.
+
+    Returns:
+        np.array: uint8 codes of bases, T=0, C=1, A=2, G=3 and N=4.
+
+    """
+    info = index[chrom]
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    # 4 bases per byte, first base in the highest bits
+    packed = np.asarray(mm[info['offset'] + start // 4: info['offset'] + (end + 3) // 4])
+    seq = np.empty((packed.shape[0], 4), dtype=np.uint8)
+    for i in range(4):
+        seq[:, i] = (packed >> (6 - 2 * i)) & 3
+    seq = seq.ravel()[start % 4: start % 4 + end - start]
+    del mm
+    # N blocks
+    n_starts, n_ends = info['n_starts'], info['n_starts'] + info['n_sizes']
+    for s, e in zip(n_starts[(n_ends > start) & (n_starts < end)], n_ends[(n_ends > start) & (n_starts < end)]):
+        seq[max(s, start) - start: min(e, end) - start] = 4
+    return seq
+
+
+def _twobit_endian(mm):
+    """ Byte order of a 2bit file from its signature."""
+    if mm[:4].view('<u4')[0] == 0x1A412743:
+        return '<'
+    assert mm[:4].view('>u4')[0] == 0x1A412743, 'Not a 2bit file'
+    return '>'
+
+
+def _read_uint32(mm, pos, endian):
+    return int(mm[pos:pos+4].view(endian + 'u4')[0])
+
+
+def _tri_context_matrix():
+    """ 64 x 32 matrix mapping trinucleotides (2bit code order) to CONTEXTS."""
+    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+    mat = np.zeros((64, 32))
+    for code in range(64):
+        tri = ''.join(TWOBIT_BASES[(code >> (4 - 2 * i)) & 3] for i in range(3))
+        if tri[1] not in 'CT':
+            tri = ''.join(complement[i] for i in tri[::-1])
+        mat[code, CONTEXTS.index(tri)] = 1
+    return mat
+
+
+def _feature_matrix():
+    """ 32 x 46 matrix aggregating CONTEXTS counts to context and 2-mer counts."""
+    ctx = np.array(CONTEXTS)
+    two_5p = np.array([[c[1:] == k for k in TWO_MERS_5P] for c in ctx], dtype=np.float64)
+    two_3p = np.array([[c[:2] == k for k in TWO_MERS_3P] for c in ctx], dtype=np.float64)
+    return np.c_[np.eye(32), two_5p, two_3p]
@@ -0,0 +1,119 @@
+""" GLM fitting by IRLS on row blocks.
+
+Binomial (logit link) and negative binomial (log link, alpha=1) GLMs are fitted
+as in statsmodels GLM.fit(), but X'WX and X'Wz are accumulated over row blocks
+of X in each IRLS iteration. X is never copied as a whole, so it can be a
+memory map (e.g., dataIO.StoreMatrix) and the memory used by fitting is
+O(n_bins + block_size * n_features).
+
+"""
+import logging
+import numpy as np
+from scipy.special import expit
+
+
+logger = logging.getLogger('GLM')
+FLOAT_EPS = np.finfo(float).eps
+
+
+def fit_glm(X, y, model_name, scaler=None, block_size=20000, max_iter=100, tol=1e-8):
+    """ Fit a GLM with an intercept by IRLS.
+
+    The intercept is the last coefficient. IRLS starts from the same mu as statsmodels
+    and stops when the change of deviance is below tol.
+
+    Args:
+        X (np.array): feature matrix, or any matrix whose row slices are np.array (e.g., np.memmap).
+        y (pd.df): four columns response table.
+        model_name (str): 'Binomial' or 'NegativeBinomial'.
+        scaler (RobustScaler): fitted scaler applied to each row block. None if X is scaled.
+        block_size (int): number of rows per block.
+        max_iter (int): max IRLS iteration.
+        tol (float): tolerance of deviance change.
+
+    Returns:
+        np.array: coefficients, intercept last.
+        np.array: fitted mean of each row; probability for Binomial and count for NegativeBinomial.
+        float: scale, always 1 for both families.
+
+    """
+    n_trials = y.length.values * y.N.values
+    if model_name == 'Binomial':
+        endog = y.nMut.values / n_trials
+        offset = np.zeros(y.shape[0])
+        mu = (endog + .5) / 2
+        eta = np.log(np.clip(mu, FLOAT_EPS, 1 - FLOAT_EPS) / (1 - np.clip(mu, FLOAT_EPS, 1 - FLOAT_EPS)))
+    elif model_name == 'NegativeBinomial':
+        endog = y.nMut.values.astype(float)
+        # exposure is length * N + 1
+        offset = np.log(n_trials + 1.)
+        n_trials = None
+        mu = (endog + endog.mean()) / 2
+        eta = np.log(mu)
+    else:
+        raise ValueError('Unknown GLM name {}. Must be Binomial or NegativeBinomial'.format(model_name))
+    n_row, n_col = X.shape
+    dev_old = _deviance(model_name, endog, mu, n_trials)
+    params = None
+    converged = False
+    for it in range(max_iter + 1):
+        # one pass over X: update eta and mu with params, then accumulate the next WLS
+        xwx = np.zeros((n_col + 1, n_col + 1))
+        xwz = np.zeros(n_col + 1)
+        dev = 0.
+        for start in range(0, n_row, block_size):
+            end = min(start + block_size, n_row)
+            Xb = _design_block(X, start, end, scaler)
+            if params is not None:
+                eta[start:end] = np.dot(Xb, params) + offset[start:end]
+                mu[start:end] = _fitted(model_name, eta[start:end])
+                dev += _deviance(model_name, endog[start:end], mu[start:end],
+                                 None if n_trials is None else n_trials[start:end])
+            w, z = _working(model_name, endog[start:end], mu[start:end], eta[start:end],
+                            None if n_trials is None else n_trials[start:end], offset[start:end])
+            xwx += np.dot(Xb.T, Xb * w[:, np.newaxis])
+            xwz += np.dot(Xb.T, w * z)
+        if params is not None:
+            converged = abs(dev - dev_old) <= tol
+            dev_old = dev
+            if converged or it == max_iter:
+                break
+        params = np.linalg.lstsq(xwx, xwz, rcond=None)[0]
+    logger.info('IRLS {} after {} iterations, deviance = {:.4f}'.format(
+        'converged' if converged else 'did not converge', it, dev_old))
+    return params, mu, 1.
+
+
+def _design_block(X, start, end, scaler=None):
+    """ Rows [start, end) of X in float64, scaled, with a constant column appended."""
+    Xb = np.empty((end - start, X.shape[1] + 1))
+    Xb[:, :-1] = X[start:end]
+    if scaler is not None:
+        Xb[:, :-1] -= scaler.center_
+        Xb[:, :-1] /= scaler.scale_
+    Xb[:, -1] = 1.
+    return Xb
+
+
+def _fitted(model_name, eta):
+    """ Inverse link."""
+    return expit(eta) if model_name == 'Binomial' else np.exp(eta)
+
+
+def _working(model_name, endog, mu, eta, n_trials, offset):
+    """ IRLS weights and working response (without offset)."""
+    if model_name == 'Binomial':
+        var = mu * (1 - mu)
+        return n_trials * var, eta + (endog - mu) / var - offset
+    # NB with alpha=1: var = mu + mu^2 and d(eta)/d(mu) = 1/mu
+    return mu / (1 + mu), eta + (endog - mu) / mu - offset
+
+
+def _deviance(model_name, endog, mu, n_trials):
+    """ Deviance of a GLM family."""
+    if model_name == 'Binomial':
+        dev = endog * np.log(np.clip(endog / (mu + 1e-20), FLOAT_EPS, np.inf)) + \
+            (1 - endog) * np.log(np.clip((1 - endog) / (1 - mu + 1e-20), FLOAT_EPS, np.inf))
+        return 2 * np.sum(n_trials * dev)
+    dev = endog * np.log(np.clip(endog / mu, FLOAT_EPS, np.inf)) - (endog + 1) * np.log((endog + 1) / (mu + 1))
+    return 2 * np.sum(dev)
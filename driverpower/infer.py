@@ -7,19 +7,25 @@ This module supports:
 
 """
 
+import functools
 import logging
+import multiprocessing.pool
 import sys
 import os
 import numpy as np
-from scipy.stats import binom_test, nbinom
-from driverpower.dataIO import read_model, read_feature, read_response, read_fs
+import pandas as pd
+from scipy.stats import binom, nbinom
+from scipy.special import expit
+from driverpower.dataIO import read_model, read_feature, iter_feature, read_response, read_response_list, read_fs
 from driverpower.dataIO import save_result
-from driverpower.model import scale_data, report_metrics
+from driverpower.model import report_metrics
+from driverpower.binindex import bin_index, lookup_bins, bin_order, find_bins, align_bins
+from driverpower.cache import pred_cache_key, read_pred_cache, save_pred_cache
+from driverpower.profiler import start_profile, stage, save_report
 import warnings
 with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=FutureWarning)
     import xgboost as xgb
-    from statsmodels.sandbox.stats.multicomp import multipletests
 
 
 logger = logging.getLogger('INFER')
@@ -29,75 +35,303 @@ def make_inference(model_path,
                    X_path, y_path,
                    fs_path=None, fs_cut=None,
                    test_method='auto', scale=1, use_gmean=True,
-                   project_name= None, out_dir='./output'):
+                   project_name= None, out_dir='./output',
+                   chunk_size=None, cache_dir=None, cache_size=10, n_jobs=1, profile=False, dtype='float64'):
     """ Main wrapper function for inference
 
     Args:
         model_path (str): path to the model
         X_path (str): path to the X
-        y_path (str): path to the y
+        y_path (str or list): path to the y, or a list of paths to y and manifests (TSV with name and path).
+            With more than one y, X is loaded and predicted once for all cohorts.
         fs_path (str): path to the functional score file
         fs_cut (str): "CADD:0.01;DANN:0.03;EIGEN:0.3"
         test_method (str): 'binomial', 'negative_binomial' or 'auto'.
         scale (float): scaling factor used in negative binomial distribution.
         use_gmean (bool): use geometric mean in test.
         out_dir (str): output file directory
+        chunk_size (int): number of bins per chunk for prediction.
+            None to load all bins at once.
+        cache_dir (str): directory of the prediction cache. None to disable the cache.
+        cache_size (float): maximum size of the prediction cache in GB.
+        n_jobs (int): number of cohorts tested in parallel.
+        profile (bool): save time and memory usage of each stage to [project_name].run_report.json
+        dtype (str): data type of features, 'float64' or 'float32'. With float32, features are
+            read and scored in float32 to halve the memory.
 
     Returns:
 
     """
-    model = read_model(model_path)
+    if profile:
+        start_profile('infer')
+    with stage('read_model'):
+        model = read_model(model_path)
     logger.info('Model type: {}'.format(model['model_name']))
     model_name = model['model_name']
+    if model_name not in ('Binomial', 'NegativeBinomial', 'GBM'):
+        logger.error('Unknown background model: {}. Please use Binomial, NegativeBinomial or GBM'.format(model_name))
+        sys.exit(1)
     if project_name is None:
         project_name = model['project_name']  # use old project name if it's not provided
     # check/make output dir
     os.makedirs(out_dir, exist_ok=True)
     # print out_dir, project_name
     logger.info('Results will be saved to {} with prefix {}'.format(out_dir, project_name))
+    cohorts = read_response_list([y_path] if isinstance(y_path, str) else y_path)
+    if len(cohorts) > 1:
+        make_batch_inference(model, model_path, X_path, cohorts,
+                             fs_path, fs_cut, test_method, scale, use_gmean,
+                             project_name, out_dir, chunk_size, cache_dir, cache_size, n_jobs, dtype)
+        save_report(project_name, out_dir)
+        logger.info('Job done!')
+        return
     # Load data
-    X = read_feature(X_path)
-    # order X by feature names of training data
-    X = X.loc[:, model['feature_names']]
-    y = read_response(y_path)
-    # use bins with both X and y
-    use_bins = np.intersect1d(X.index.values, y.index.values)
-    X = X.loc[use_bins, :].values  # X is np.array now
-    y = y.loc[use_bins, :]
-    # scale X for GLM
-    if model_name in ('Binomial', 'NegativeBinomial'):
-        scaler = model['scaler']
-        X = scale_data(X, scaler)
-        X = X[:, np.isin(model['feature_names'], model['use_features'])]
-    # make prediction
-    if model_name in ('Binomial', 'NegativeBinomial'):
-        y['nPred'] = predict_with_glm(X, y, model)
-    elif model_name == 'GBM':
-        y['nPred'] = predict_with_gbm(X, y, model)
+    with stage('read_response'):
+        y = read_response(cohorts[0][1])
+    pred = None
+    if cache_dir is not None:
+        with stage('read_cache'):
+            cache_key = pred_cache_key(cache_dir, model_path, X_path, y.index.values, y, dtype)
+            pred = read_pred_cache(cache_dir, cache_key)
+    if pred is not None:
+        # skip prediction
+        y = y.iloc[find_bins(y.index.values, pred.index.values), :]
+        y['nPred'] = pred.values
+    elif chunk_size is None:
+        with stage('read_feature'):
+            X = read_feature(X_path, list(model['feature_names']), use_bins=y.index.values, dtype=dtype)
+        # use bins with both X and y
+        use_bins, (x_rows, y_rows) = align_bins(X.index.values, y.index.values)
+        # order X by feature names of training data
+        X = X.values[np.ix_(x_rows, X.columns.get_indexer(model['feature_names']))]  # X is np.array now
+        y = y.iloc[y_rows, :]
+        with stage('predict'):
+            y['nPred'] = predict(X, y, model)
     else:
-        logger.error('Unknown background model: {}. Please use Binomial, NegativeBinomial or GBM'.format(model_name))
-        sys.exit(1)
+        # stream bins through prediction
+        logger.info('Predicting in chunks of {} bins'.format(chunk_size))
+        res = []
+        # binIDs of y are encoded once; chunks only search the dictionary
+        y_index = bin_index(y.index.values)
+        chunks = iter_feature(X_path, list(model['feature_names']), y.index.values, chunk_size, dtype)
+        while True:
+            with stage('read_feature'):
+                X = next(chunks, None)
+            if X is None:
+                break
+            X = X.loc[:, model['feature_names']]
+            y_chunk = y.iloc[lookup_bins(y_index, X.index.values), :]
+            with stage('predict'):
+                y_chunk['nPred'] = predict(X.values, y_chunk, model)
+            res.append(y_chunk)
+            del X
+        res = pd.concat(res)
+        assert res.index.is_unique, "binID in feature table is not unique."
+        # same bin order as without chunks
+        y = res.iloc[bin_order(res.index.values), :]
+        del res
+    with stage('burden_test'):
+        y['raw_p'] = raw_burden_test(y, model, test_method, scale, use_gmean)
+    if cache_dir is not None and pred is None:
+        with stage('save_cache'):
+            save_pred_cache(cache_dir, cache_key, y.nPred, cache_size)
+    logger.info('Use {} bins in inference'.format(y.shape[0]))
+    # print test set metrics
+    report_metrics(y.nPred.values, y.nMut.values)
+    with stage('bh_fdr'):
+        y['raw_q'] = bh_fdr(y.raw_p)
+    # functional adjustment
+    with stage('functional_adjustment'):
+        y = functional_adjustment(y, fs_path, fs_cut, test_method,
+                                  model, scale, use_gmean)
+    # save to disk
+    with stage('save_result'):
+        save_result(y, project_name, out_dir)
+    save_report(project_name, out_dir)
+    logger.info('Job done!')
+
+
+def make_batch_inference(model, model_path, X_path, cohorts,
+                         fs_path=None, fs_cut=None,
+                         test_method='auto', scale=1, use_gmean=True,
+                         project_name=None, out_dir='./output',
+                         chunk_size=None, cache_dir=None, cache_size=10, n_jobs=1, dtype='float64'):
+    """ Inference for multiple cohorts (response tables) with one feature table.
+
+    Mutation rates are predicted once for the union of bins in all cohorts;
+    nPred of each cohort is the rate times its exposure (see pred_exposure).
+    Burden test, functional adjustment and output are done per cohort.
+    Results are saved as [project_name.]cohort.result.tsv.
+
+    Args:
+        model (dict): model meta-data.
+        model_path (str): path to the model, used by the prediction cache.
+        X_path (str): path to the X
+        cohorts (list): list of (name, path to y).
+        Other args are the same as in make_inference.
+
+    Returns:
+
+    """
+    with stage('read_response'):
+        ys = [(name, read_response(path)) for name, path in cohorts]
+    bins = np.unique(np.concatenate([y.index.values for name, y in ys]))
+    logger.info('Predict mutation rates of {} bins for {} cohorts'.format(bins.shape[0], len(ys)))
+    rate = None
+    if cache_dir is not None:
+        with stage('read_cache'):
+            cache_key = pred_cache_key(cache_dir, model_path, X_path, bins, dtype=dtype)
+            rate = read_pred_cache(cache_dir, cache_key)
+    if rate is None:
+        with stage('predict_rate'):
+            rate = predict_rate_of_bins(model, X_path, bins, chunk_size, dtype)
+        if cache_dir is not None:
+            with stage('save_cache'):
+                save_pred_cache(cache_dir, cache_key, rate, cache_size)
+    n_jobs = max(1, min(n_jobs, len(ys)))
+    # data shared by worker threads; processes are not forked after xgboost has run OpenMP threads
+    cohort_data = dict(ys=ys, rate=rate, model=model, fs_path=fs_path, fs_cut=fs_cut,
+                       test_method=test_method, scale=scale, use_gmean=use_gmean,
+                       project_name=project_name, out_dir=out_dir)
+    with stage('test_cohorts'):
+        if n_jobs == 1:
+            for i in range(len(ys)):
+                _infer_cohort(cohort_data, i)
+        else:
+            logger.info('Testing {} cohorts in parallel'.format(n_jobs))
+            with multiprocessing.pool.ThreadPool(n_jobs) as pool:
+                pool.map(functools.partial(_infer_cohort, cohort_data), range(len(ys)))
+
+
+def _infer_cohort(cohort_data, i):
+    """ Test cohort i with predicted rates. Data are read from cohort_data (see make_batch_inference)."""
+    name, y = cohort_data['ys'][i]
+    rate = cohort_data['rate']
+    model = cohort_data['model']
+    test_method = cohort_data['test_method']
+    scale = cohort_data['scale']
+    use_gmean = cohort_data['use_gmean']
+    project_name = name if cohort_data['project_name'] is None \
+        else '{}.{}'.format(cohort_data['project_name'], name)
+    # use bins with both X and y
+    use_bins, (rate_rows, y_rows) = align_bins(rate.index.values, y.index.values)
+    y = y.iloc[y_rows, :]
+    logger.info('Cohort {}: use {} bins in inference'.format(name, y.shape[0]))
+    y['nPred'] = rate.values[rate_rows] * pred_exposure(y, model['model_name'])
+    y['raw_p'] = raw_burden_test(y, model, test_method, scale, use_gmean)
     # print test set metrics
     report_metrics(y.nPred.values, y.nMut.values)
-    # burden test
-    count = np.sqrt(y.nMut * y.nSample) if use_gmean else y.nMut
-    offset = y.length * y.N + 1
-    y['raw_p'] = burden_test(count, y.nPred, offset,
-                             test_method, model, scale)
     y['raw_q'] = bh_fdr(y.raw_p)
     # functional adjustment
-    y = functional_adjustment(y, fs_path, fs_cut, test_method,
+    y = functional_adjustment(y, cohort_data['fs_path'], cohort_data['fs_cut'], test_method,
                               model, scale, use_gmean)
     # save to disk
-    save_result(y, project_name, out_dir)
-    logger.info('Job done!')
+    save_result(y, project_name, cohort_data['out_dir'])
+
+
+def predict_rate_of_bins(model, X_path, bins, chunk_size=None, dtype='float64'):
+    """ Load features of bins and predict mutation rates.
+
+    Args:
+        model (dict): model meta-data.
+        X_path (str): path to the X
+        bins (np.array): binIDs to predict.
+        chunk_size (int): number of bins per chunk. None to load all bins at once.
+        dtype (str): data type of features.
+
+    Returns:
+        pd.Series: rates indexed by binID, sorted by binID.
+
+    """
+    if chunk_size is None:
+        chunks = [read_feature(X_path, list(model['feature_names']), use_bins=bins, dtype=dtype)]
+    else:
+        chunks = iter_feature(X_path, list(model['feature_names']), bins, chunk_size, dtype)
+    rate = []
+    for X in chunks:
+        X = X.loc[:, model['feature_names']]
+        rate.append(pd.Series(predict_rate(X.values, model), index=X.index))
+        del X
+    rate = pd.concat(rate)
+    assert rate.index.is_unique, "binID in feature table is not unique."
+    return rate.iloc[bin_order(rate.index.values)]
+
+
+def predict_rate(X, model):
+    """ Predict mutation rate per unit of exposure.
+
+    nPred = rate * pred_exposure(y, model_name).
+
+    Args:
+        X (np.array): feature matrix, columns ordered by model['feature_names'].
+        model (dict): model meta-data.
+
+    Returns:
+        np.array: array of rates.
+
+    """
+    model_name = model['model_name']
+    if model_name in ('Binomial', 'NegativeBinomial'):
+        linpred = glm_linpred(X, model)
+        return expit(linpred) if model_name == 'Binomial' else np.exp(linpred)
+    # GBM rates are exp of the margin without offset, in float64 (see predict_with_gbm)
+    data = xgb.DMatrix(data=X, feature_names=list(model['feature_names']))
+    data.set_base_margin(np.zeros(X.shape[0]))
+    kfold = model['kfold']
+    rate = np.zeros(X.shape[0])
+    for k in range(1, kfold+1):
+        model['model'][k].set_param(model['params'])  # Bypass a bug of dumping without max_delta_step
+        rate += np.exp(model['model'][k].predict(data, output_margin=True).astype(np.float64))
+    return rate / kfold
+
+
+def pred_exposure(y, model_name):
+    """ Exposure of bins: length * N for binomial GLM; length * N + 1 for others (log link)."""
+    exposure = (y.length * y.N).values
+    return exposure if model_name == 'Binomial' else exposure + 1
+
+
+def predict(X, y, model):
+    """ Predict number of mutations for a set of bins.
+
+    Args:
+        X (np.array): feature matrix, columns ordered by model['feature_names'].
+        y (pd.df): response of the same bins.
+        model (dict): model meta-data.
+
+    Returns:
+        np.array: predicted number of mutations (nPred).
+
+    """
+    if model['model_name'] in ('Binomial', 'NegativeBinomial'):
+        return predict_with_glm(X, y, model)
+    return predict_with_gbm(X, y, model)
+
+
+def raw_burden_test(y, model, test_method='auto', scale=1, use_gmean=True):
+    """ Burden test with observed (nMut, nSample) and predicted (nPred) number of mutations.
+
+    Args:
+        y (pd.df): response with nPred.
+        model (dict): model meta-data.
+        test_method (str): 'binomial', 'negative_binomial' or 'auto'.
+        scale (float): scaling factor used in negative binomial distribution.
+        use_gmean (bool): use geometric mean in test.
+
+    Returns:
+        np.array: array of raw p-values.
+
+    """
+    count = np.sqrt(y.nMut * y.nSample) if use_gmean else y.nMut
+    offset = y.length * y.N + 1
+    return burden_test(count, y.nPred, offset, test_method, model, scale)
 
 
 def predict_with_glm(X, y, model):
     """ Predict number of mutation with GLM.
 
     Args:
-        X (np.array): feature matrix.
+        X (np.array): feature matrix, columns ordered by model['feature_names'].
         y (pd.df): response.
         model (dict): model meta-data.
 
@@ -105,75 +339,153 @@ def predict_with_glm(X, y, model):
         np.array: array of predictions.
 
     """
-    # Add const. to X
-    X = np.c_[X, np.ones(X.shape[0])]
+    linpred = glm_linpred(X, model)
     if model['model_name'] == 'Binomial':
-        pred = np.array(model['model'].predict(X) * y.length * y.N)
+        pred = expit(linpred) * (y.length * y.N).values
     elif model['model_name'] == 'NegativeBinomial':
-        pred = np.array(model['model'].predict(X, exposure=(y.length * y.N).values + 1))
+        pred = np.exp(linpred) * ((y.length * y.N).values + 1)
     else:
         sys.stderr.write('Wrong model name in model info: {}. Need Binomial or NegativeBinomial.'.format(model['model_name']))
         sys.exit(1)
     return pred
 
 
-def predict_with_gbm(X, y, model):
+def glm_scorer(model):
+    """ Compact GLM scorer on unscaled features.
+
+    Robust scaling is folded into the coefficients: sum(b * (x - center) / scale) + b0
+    = sum(x * b / scale) + b0 - sum(b * center / scale).
+
+    Args:
+        model (dict): model meta-data.
+
+    Returns:
+        np.array: indices of used features in model['feature_names'].
+        np.array: coefficients of used features.
+        float: intercept.
+
+    """
+    # GLM coefficients, intercept last (statsmodels results in legacy pickles)
+    glm_coef = model['coef'] if 'coef' in model else np.asarray(model['model'].params)
+    if 'use_index' in model:
+        use_index = model['use_index']
+    else:
+        use_index = np.flatnonzero(np.isin(model['feature_names'], model['use_features']))
+    coef = glm_coef[:-1] / model['scaler'].scale_[use_index]
+    intercept = glm_coef[-1] - np.dot(coef, model['scaler'].center_[use_index])
+    return use_index, coef, intercept
+
+
+def glm_linpred(X, model, block_size=100000):
+    """ Linear predictor of GLM.
+
+    Used features of each row block are gathered and multiplied with the scorer
+    coefficients (see glm_scorer), so X is neither scaled nor copied as a whole.
+    float32 X is scored with float32 coefficients; the result and the intercept are float64.
+
+    Args:
+        X (np.array): feature matrix, columns ordered by model['feature_names'].
+        model (dict): model meta-data.
+        block_size (int): number of rows per block.
+
+    Returns:
+        np.array: linear predictor.
+
     """
+    use_index, coef, intercept = glm_scorer(model)
+    coef = coef.astype(np.float32) if X.dtype == np.float32 else coef
+    # all features are used: no gather
+    use_all = np.array_equal(use_index, np.arange(X.shape[1]))
+    linpred = np.empty(X.shape[0])
+    for start in range(0, X.shape[0], block_size):
+        block = X[start:start+block_size] if use_all else X[start:start+block_size, use_index]
+        linpred[start:start+block_size] = np.dot(block, coef)
+    return linpred + intercept
+
+
+def predict_with_gbm(X, y, model):
+    """ Predict number of mutations with GBM.
+
+    The offset log(length * N + 1) is applied in float64 to the rate (see predict_rate),
+    rather than as a float32 base margin in xgboost, so predictions are the same
+    as in batch inference, where rates are shared by cohorts with different offsets.
 
     Args:
-        X:
-        y:
-        model:
+        X (np.array): feature matrix, columns ordered by model['feature_names'].
+        y (pd.df): response.
+        model (dict): model meta-data.
 
     Returns:
+        np.array: array of predictions.
 
     """
     assert model['model_name'] == 'GBM',\
         'Wrong model name in model info: {}. Need GBM.'.format(model['model_name'])
-    testData = xgb.DMatrix(data=X, label=y.nMut.values, feature_names=model['feature_names'])
-    testData.set_base_margin(np.array(np.log(y.length+1/y.N) + np.log(y.N)))
-    kfold = model['kfold']
-    pred = np.zeros(y.shape[0])
-    for k in range(1, kfold+1):
-        model['model'][k].set_param(model['params'])  # Bypass a bug of dumping without max_delta_step
-        pred += model['model'][k].predict(testData)
-    pred = pred / kfold
-    return pred
+    return predict_rate(X, model) * pred_exposure(y, model['model_name'])
 
 
 def burden_test(count, pred, offset, test_method, model, s):
     """ Perform burden test.
 
+    All inputs are treated as arrays and tested in one vectorized call.
+    P-values are identical to the former per-element tests
+    (``scipy.stats.binom_test`` and ``negbinom_test`` on scalars) up to
+    floating-point rounding (absolute difference < 1e-12).
+
     Args:
-        count:
-        pred:
-        offset:
-        test_method:
-        model:
-        s:
-        use_gmean:
+        count (np.array): observed number of mutations (or gmean).
+        pred (np.array): predicted number of mutations.
+        offset (np.array): length * N + 1 per element.
+        test_method (str): 'binomial', 'negative_binomial' or 'auto'.
+        model (dict): model meta-data.
+        s (float): scaling factor for theta.
 
     Returns:
+        np.array: array of p-values.
 
     """
+    count = np.asarray(count, dtype=np.float64)
+    pred = np.asarray(pred, dtype=np.float64)
+    offset = np.asarray(offset, dtype=np.float64)
     if test_method == 'auto':
         test_method = 'binomial' if model['pval_dispersion'] > 0.05 else 'negative_binomial'
     if test_method == 'negative_binomial':
         logger.info('Using negative binomial test with s={}, theta={}'.format(s, model['theta']))
         theta = s * model['theta']
-        pvals = np.array([negbinom_test(x, mu, theta, o)
-                          for x, mu, o in zip(count, pred, offset)])
+        pvals = negbinom_test(count, pred, theta, offset)
     elif test_method == 'binomial':
         logger.info('Using binomial test')
-        pvals = np.array([binom_test(x, n, p, 'greater')
-                          for x, n, p in zip(count, offset,
-                                             pred/offset)])
+        pvals = binomial_test(count, offset, pred/offset)
     else:
         logger.error('Unknown test method: {}. Please use binomial, negative_binomial or auto'.format(test_method))
         sys.exit(1)
     return pvals
 
 
+def binomial_test(x, n, p):
+    """ One-sided (greater) binomial test.
+
+    Vectorized version of ``scipy.stats.binom_test(x, n, p, 'greater')``.
+    As in scipy, non-integer x and n (e.g., gmean of nMut and nSample) are truncated.
+
+    Args:
+        x (np.array): observed number of mutations (or gmean).
+        n (np.array): number of trials.
+        p (np.array): probability of success.
+
+    Returns:
+        np.array: p-values. pval = 1 - F(n<x)
+
+    """
+    x = np.floor(x)
+    n = np.floor(n)
+    p = np.asarray(p, dtype=np.float64)
+    if np.any((p > 1.0) | (p < 0.0)):
+        raise ValueError("p must be in range [0,1]")
+    pval = binom.sf(x - 1, n, p)
+    return np.minimum(1.0, pval)
+
+
 def negbinom_test(x, mu, theta, offset):
     """ Test with negative binomial distribution
 
@@ -183,36 +495,45 @@ def negbinom_test(x, mu, theta, offset):
     n = mu * p / (1 - p)
 
     Args:
-        x (float): observed number of mutations (or gmean).
-        mu (float): predicted number of mutations (mean of negative binomial distribution).
+        x (np.array): observed number of mutations (or gmean).
+        mu (np.array): predicted number of mutations (mean of negative binomial distribution).
         theta (float): dispersion parameter of negative binomial distribution.
+        offset (np.array): length * N + 1 per element.
 
     Returns:
-        float: p-value from NB CDF. pval = 1 - F(n<x)
+        np.array: p-values from NB CDF. pval = 1 - F(n<x); 1 for elements with 0 bp (offset == 1).
 
     """
-    if offset == 1:  # element with 0 bp
-        return 1
+    x = np.asarray(x, dtype=np.float64)
+    mu = np.asarray(mu, dtype=np.float64)
     p = 1 / (theta * mu + 1)
     n = mu * p / (1 - p)
-    pval = 1 - nbinom.cdf(x, n, p, loc=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pval = 1 - nbinom.cdf(x, n, p, loc=1)
+    # element with 0 bp
+    pval = np.where(np.asarray(offset) == 1, 1.0, pval)
     return pval
 
 
 def functional_adjustment(y, fs_path, fs_cut, test_method,
                           model, scale, use_gmean=True):
-    """
+    """ Functional adjusted burden test.
+
+    Near-significant elements (raw_q <= 0.25) are weighted by each functional score
+    (score / phred-scaled cutoff) and by the average weight if two or more scores are used.
+    Tests and BH corrections for all scores run in one batch.
 
     Args:
-        y:
-        fs_path:
-        fs_cut:
-        test_method:
-        model:
-        scale:
-        use_gmean:
+        y (pd.df): response with nPred, raw_p and raw_q.
+        fs_path (str): path to the functional score file.
+        fs_cut (str): "CADD:0.01,DANN:0.03,EIGEN:0.3".
+        test_method (str): 'binomial', 'negative_binomial' or 'auto'.
+        model (dict): model meta-data.
+        scale (float): scaling factor used in negative binomial distribution.
+        use_gmean (bool): use geometric mean in test.
 
     Returns:
+        pd.df: y with functional scores and [score]_weight, [score]_nMut, [score]_p, [score]_q columns.
 
     """
     if fs_path is None:
@@ -220,10 +541,12 @@ def functional_adjustment(y, fs_path, fs_cut, test_method,
     # Convert fs_cut to a dict. "CADD:0.01,DANN:0.03,EIGEN:0.3"
     fs_cut_dict = dict([i.split(':') for i in fs_cut.strip().split(',')])
     fs = read_fs(fs_path, fs_cut_dict)
-    # merge with y
-    y = y.join(fs)
-    ct = 0  # number of score used
-    avg_weight = np.zeros(y.shape[0])
+    # merge with y; NaN for bins without scores
+    rows = find_bins(fs.index.values, y.index.values)
+    fs = pd.DataFrame(np.where(rows[:, np.newaxis] >= 0, fs.values[rows], np.nan), index=y.index, columns=fs.columns)
+    y = pd.concat([y, fs], axis=1)
+    scores = []  # scores used
+    thresholds = []
     for score, cutoff in fs_cut_dict.items():
         logger.info('Using {} scores'.format(score))
         if float(cutoff) < 0  or float(cutoff) > 1:
@@ -231,48 +554,65 @@ def functional_adjustment(y, fs_path, fs_cut, test_method,
             continue
         if float(cutoff) == 0:
             cutoff = 0.001  # add a small number for 0 cutoff
-        threshold = -10*np.log10(float(cutoff))  # convert to phred-scale
-        # Calculate weight for near-significant elements
-        weight = score+'_weight'
-        y[weight] = y[score] / threshold
-        # set 1 to the rest
-        y.loc[y.raw_q>.25, weight] = 1
-        y[weight].fillna(1, inplace=True)
-        # Calculate sqrt(nMut*nSample) * weight for near-significant elements
-        n_score = score+'_nMut'
-        y[n_score] = y[weight] * np.sqrt(y.nMut * y.nSample) if use_gmean else y[weight] * y.nMut
-        # Calculate p-values (q-values) for near-significant elements
-        count = y.loc[y.raw_q<=.25, n_score]
-        offset = y.loc[y.raw_q<=.25, 'length'] * y.loc[y.raw_q<=.25, 'N'] + 1
-        p_adj = score+'_p'
-        y[p_adj] = y.raw_p
-        y.loc[y.raw_q<=.25, p_adj] = burden_test(count, y.loc[y.raw_q<=.25, 'nPred'],
-                                                 offset, test_method, model, scale)
-        q_adj = score+'_q'
-        y[q_adj] = bh_fdr(y[p_adj])
-        avg_weight += y[weight]
-        ct += 1
+        scores.append(score)
+        thresholds.append(-10*np.log10(float(cutoff)))  # convert to phred-scale
+    if len(scores) == 0:
+        return y
+    # near-significant elements
+    is_test = (y.raw_q <= .25).values
+    is_rest = (y.raw_q > .25).values
+    # Calculate weight for near-significant elements; set 1 to the rest
+    weight = y.loc[:, scores].values / np.array(thresholds)
+    weight[is_rest, :] = 1
+    weight[np.isnan(weight)] = 1
+    names = list(scores)
     # Use combined weights if more than 2 scores are used
-    if ct >= 2:
+    if len(scores) >= 2:
         logger.info('Using average weights')
-        y['avg_weight'] = avg_weight / ct
-        y['avg_nMut'] = y.avg_weight * np.sqrt(y.nMut * y.nSample) if use_gmean else y.avg_weight * y.nMut
-        y['avg_p'] = y.raw_p
-        count = y.loc[y.raw_q<=.25, 'avg_nMut']
-        offset = y.loc[y.raw_q<=.25, 'length'] * y.loc[y.raw_q<=.25, 'N'] + 1
-        y.loc[y.raw_q<=.25, 'avg_p'] = burden_test(count, y.loc[y.raw_q<=.25, 'nPred'],
-                                                   offset, test_method, model, scale)
-        y['avg_q'] = bh_fdr(y.avg_p)
+        weight = np.c_[weight, weight.mean(axis=1)]
+        names.append('avg')
+    # Calculate sqrt(nMut*nSample) * weight
+    count = np.sqrt(y.nMut * y.nSample).values if use_gmean else y.nMut.values
+    n_mut = weight * count[:, np.newaxis]
+    # Calculate p-values (q-values) for near-significant elements
+    offset = (y.length * y.N + 1).values
+    pvals = np.repeat(y.raw_p.values[:, np.newaxis], len(names), axis=1)
+    pvals[is_test, :] = burden_test(n_mut[is_test, :], y.nPred.values[is_test, np.newaxis],
+                                    offset[is_test, np.newaxis], test_method, model, scale)
+    qvals = bh_fdr(pvals)
+    res = dict()
+    cols = []
+    for i, name in enumerate(names):
+        res[name+'_weight'] = weight[:, i]
+        res[name+'_nMut'] = n_mut[:, i]
+        res[name+'_p'] = pvals[:, i]
+        res[name+'_q'] = qvals[:, i]
+        cols += [name+'_weight', name+'_nMut', name+'_p', name+'_q']
+    y = pd.concat([y, pd.DataFrame(res, index=y.index, columns=cols)], axis=1)
     return y
 
 
 def bh_fdr(pvals):
     """ BH FDR correction
 
+    Same as statsmodels multipletests(pvals, method='fdr_bh').
+    2-D input is corrected column by column.
+
     Args:
         pvals (np.array): array of p-values
 
     Returns:
         np.array: array of q-values
     """
-    return multipletests(pvals, method='fdr_bh')[1]
+    pvals = np.asarray(pvals, dtype=np.float64)
+    n = pvals.shape[0]
+    order = np.argsort(pvals, axis=0)
+    ecdf = np.arange(1, n+1, dtype=np.float64) / n
+    if pvals.ndim == 2:
+        ecdf = ecdf[:, np.newaxis]
+    qvals_sorted = np.take_along_axis(pvals, order, axis=0) / ecdf
+    qvals_sorted = np.minimum.accumulate(qvals_sorted[::-1], axis=0)[::-1]
+    qvals_sorted[qvals_sorted > 1] = 1
+    qvals = np.empty_like(qvals_sorted)
+    np.put_along_axis(qvals, order, qvals_sorted, axis=0)
+    return qvals
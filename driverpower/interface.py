@@ -3,6 +3,10 @@
 Sub-commands:
     1. model - train the BMR model.
     2. infer - test for driver elements.
+    3. convert - convert a feature table to the columnar feature store.
+    4. prepare - make the response table from mutations and elements.
+    5. subset - make the response table for a subset of donors from a mutation matrix.
+    6. features - make features (nuc: nucleotide contents; tracks: coverage of BED and bedGraph tracks).
 """
 
 
@@ -13,6 +17,9 @@ import sys
 from driverpower import __version__
 from driverpower.model import run_bmr
 from driverpower.infer import make_inference
+from driverpower.dataIO import save_feature_store
+from driverpower.prepare import make_response, subset_response
+from driverpower.features import make_nuc_features, make_track_features
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
                     format='%(asctime)s | %(levelname)s: %(message)s',
@@ -65,8 +72,27 @@ def get_args():
                          help='Path to the parameter pickle [optional]', default=None)
     par_bmr.add_argument('--gbmFold', dest='kfold', required=False, type=int,
                          help='Train gbm with k-fold, k>=2 [optional]', default=3)
+    par_bmr.add_argument('--jobs', dest='n_jobs', required=False, type=int,
+                         help='Number of worker threads for gbm folds or randomized lasso; '
+                              'nthread in --gbmParam is split among gbm folds [optional]', default=1)
     par_bmr.add_argument('--predict', dest='pred', required=False, action="store_true",
                          help='Output the prediction for training set [optional]')
+    par_bmr.add_argument('--profile', dest='profile', required=False, action="store_true",
+                         help='Save time and memory usage of each stage to [name].run_report.json [optional]')
+    par_bmr.add_argument('--dtype', dest='dtype', required=False, type=str, choices=['float64', 'float32'],
+                         help='Data type of features in memory; float32 halves the memory [optional]',
+                         default='float64')
+    par_bmr.add_argument('--initModel', dest='init_path', required=False, type=str,
+                         help='Path to a previous GBM model to update instead of training from scratch [optional]',
+                         default=None)
+    par_bmr.add_argument('--initMode', dest='init_mode', required=False, type=str, choices=['continue', 'refresh'],
+                         help='Add boosting rounds to (continue) or refit leaf values of (refresh) '
+                              'boosters of --initModel [optional]', default='continue')
+    par_bmr.add_argument('--checkpoint', dest='checkpoint', required=False, type=int,
+                         help='Save gbm boosters every N rounds (e.g., 500) to [name].GBM.checkpoint '
+                              'in --modelDir; 0 to disable [optional]', default=0)
+    par_bmr.add_argument('--resume', dest='resume', required=False, action="store_true",
+                         help='Resume gbm training from the checkpoint in --modelDir [optional]')
     par_bmr.add_argument('--name', dest='project_name', required=False, type=str,
                          help='Identifier for output files [optional]', default='DriverPower')
     par_bmr.add_argument('--modelDir', dest='out_dir', type=str,
@@ -85,10 +111,11 @@ def get_args():
     dat_infer = parser_infer.add_argument_group(title="input data")
     dat_infer.add_argument('--feature', dest='X_path', required=True, type=str,
                            help='Path to the test feature table')
-    dat_infer.add_argument('--response', dest='y_path', required=True, type=str,
-                           help='Path to the test response table')
+    dat_infer.add_argument('--response', dest='y_path', required=True, type=str, nargs='+',
+                           help='Path to the test response table. Multiple tables or manifests '
+                                '(TSV with name and path) can be given to test several cohorts at once')
     dat_infer.add_argument('--model', dest='model_path', required=True, type=str,
-                           help='Path to the model pickle')
+                           help='Path to the model bundle (or legacy model pickle)')
     dat_infer.add_argument('--funcScore', dest='fs_path', required=False, type=str,
                            help='Path to the functional score table [optional]', default=None)
     # Parameters
@@ -107,6 +134,126 @@ def get_args():
                            help='Identifier for output files [optional]', default=None)
     par_infer.add_argument('--outDir', dest='out_dir', type=str,
                            help='Directory of output files [optional]', default='./')
+    par_infer.add_argument('--chunkSize', dest='chunk_size', required=False, type=int,
+                           help='Predict and test bins in chunks of this size to bound memory use [optional]',
+                           default=None)
+    par_infer.add_argument('--jobs', dest='n_jobs', required=False, type=int,
+                           help='Number of cohorts tested in parallel [optional]', default=1)
+    par_infer.add_argument('--cacheDir', dest='cache_dir', required=False, type=str,
+                           help='Directory of the prediction cache; reuse predictions for the same '
+                                'model, features and bins [optional]', default=None)
+    par_infer.add_argument('--cacheSize', dest='cache_size', required=False, type=float,
+                           help='Maximum size (GB) of the prediction cache [optional]', default=10)
+    par_infer.add_argument('--profile', dest='profile', required=False, action="store_true",
+                           help='Save time and memory usage of each stage to [name].run_report.json [optional]')
+    par_infer.add_argument('--dtype', dest='dtype', required=False, type=str, choices=['float64', 'float32'],
+                           help='Data type of features in memory; float32 halves the memory [optional]',
+                           default='float64')
+    #
+    # Convert feature table
+    #
+    parser_convert = subparsers.add_parser('convert',
+                                           help='Convert a feature table to the columnar feature store',
+                                           formatter_class=CustomFormatter,
+                                           description='DriverPower v{}: Combined burden and functional impact '
+                                                       'tests for coding and non-coding cancer driver discovery.\n\n'
+                                                       'See documentation and examples at '
+                                                       'http://driverpower.readthedocs.io/en/latest/'.format(__version__))
+    dat_convert = parser_convert.add_argument_group(title="input data")
+    dat_convert.add_argument('--feature', dest='X_path', required=True, type=str,
+                             help='Path to the feature table (TSV or HDF5)')
+    par_convert = parser_convert.add_argument_group(title="parameters")
+    par_convert.add_argument('--out', dest='out_path', required=True, type=str,
+                             help='Path to the output feature store directory')
+    par_convert.add_argument('--chunkSize', dest='chunk_size', required=False, type=int,
+                             help='Number of rows converted per chunk [optional]', default=100000)
+    par_convert.add_argument('--dtype', dest='dtype', required=False, type=str, choices=['float64', 'float32'],
+                             help='Data type of the feature store; float32 halves the size [optional]',
+                             default='float64')
+    #
+    # Prepare response table
+    #
+    parser_prepare = subparsers.add_parser('prepare',
+                                           help='Make the response table from mutations and elements',
+                                           formatter_class=CustomFormatter,
+                                           description='DriverPower v{}: Combined burden and functional impact '
+                                                       'tests for coding and non-coding cancer driver discovery.\n\n'
+                                                       'See documentation and examples at '
+                                                       'http://driverpower.readthedocs.io/en/latest/'.format(__version__))
+    dat_prepare = parser_prepare.add_argument_group(title="input data")
+    dat_prepare.add_argument('--mut', dest='mut_path', required=True, type=str,
+                             help='Path to the mutation table (chrom, start, end, ref, alt, donor)')
+    dat_prepare.add_argument('--element', dest='ele_path', required=True, type=str,
+                             help='Path to the element table (chrom, start, end, binID)')
+    dat_prepare.add_argument('--callable', dest='callable_path', required=True, type=str,
+                             help='Path to the whitelisted regions (chrom, start, end)')
+    par_prepare = parser_prepare.add_argument_group(title="parameters")
+    par_prepare.add_argument('--out', dest='out_path', required=True, type=str,
+                             help='Path to the output response table')
+    par_prepare.add_argument('--chunkSize', dest='chunk_size', required=False, type=int,
+                             help='Number of mutations read per chunk [optional]', default=1000000)
+    par_prepare.add_argument('--matrix', dest='matrix_path', required=False, type=str,
+                             help='Path to the output mutation matrix (binID x donor) directory [optional]', default=None)
+    #
+    # Subset donors
+    #
+    parser_subset = subparsers.add_parser('subset',
+                                          help='Make the response table for a subset of donors',
+                                          formatter_class=CustomFormatter,
+                                          description='DriverPower v{}: Combined burden and functional impact '
+                                                      'tests for coding and non-coding cancer driver discovery.\n\n'
+                                                      'See documentation and examples at '
+                                                      'http://driverpower.readthedocs.io/en/latest/'.format(__version__))
+    dat_subset = parser_subset.add_argument_group(title="input data")
+    dat_subset.add_argument('--matrix', dest='matrix_path', required=True, type=str,
+                            help='Path to the mutation matrix directory from prepare --matrix')
+    dat_subset.add_argument('--donor', dest='donor_path', required=False, type=str,
+                            help='Path to donor IDs, one per line. Default is all donors [optional]', default=None)
+    par_subset = parser_subset.add_argument_group(title="parameters")
+    par_subset.add_argument('--exclude', dest='exclude', required=False, action="store_true",
+                            help='Use all donors except those in --donor [optional]')
+    par_subset.add_argument('--out', dest='out_path', required=True, type=str,
+                            help='Path to the output response table')
+    #
+    # Make features
+    #
+    parser_features = subparsers.add_parser('features',
+                                            help='Make features for elements',
+                                            description='DriverPower v{}: Combined burden and functional impact '
+                                                        'tests for coding and non-coding cancer driver discovery.\n\n'
+                                                        'See documentation and examples at '
+                                                        'http://driverpower.readthedocs.io/en/latest/'.format(__version__))
+    feature_parsers = parser_features.add_subparsers(title='The feature types include', dest='feature_type')
+    parser_nuc = feature_parsers.add_parser('nuc',
+                                            help='Nucleotide contents from a 2bit reference genome',
+                                            formatter_class=CustomFormatter)
+    dat_nuc = parser_nuc.add_argument_group(title="input data")
+    dat_nuc.add_argument('--element', dest='ele_path', required=True, type=str,
+                         help='Path to the element table (chrom, start, end, binID)')
+    dat_nuc.add_argument('--genome', dest='genome_path', required=True, type=str,
+                         help='Path to the reference genome in UCSC 2bit format')
+    dat_nuc.add_argument('--callable', dest='callable_path', required=False, type=str,
+                         help='Path to the whitelisted regions (chrom, start, end) [optional]', default=None)
+    par_nuc = parser_nuc.add_argument_group(title="parameters")
+    par_nuc.add_argument('--out', dest='out_path', required=True, type=str,
+                         help='Path to the output feature table')
+    par_nuc.add_argument('--jobs', dest='n_jobs', required=False, type=int,
+                         help='Number of chromosomes counted in parallel [optional]', default=1)
+    parser_tracks = feature_parsers.add_parser('tracks',
+                                               help='Coverage of BED and bedGraph tracks',
+                                               formatter_class=CustomFormatter)
+    dat_tracks = parser_tracks.add_argument_group(title="input data")
+    dat_tracks.add_argument('--element', dest='ele_path', required=True, type=str,
+                            help='Path to the element table (chrom, start, end, binID)')
+    dat_tracks.add_argument('--track', dest='track_paths', required=True, type=str, nargs='+',
+                            help='Paths to BED (*.bed, *.narrowPeak) or bedGraph (*.bedGraph, *.bg) tracks')
+    dat_tracks.add_argument('--callable', dest='callable_path', required=False, type=str,
+                            help='Path to the whitelisted regions (chrom, start, end) [optional]', default=None)
+    par_tracks = parser_tracks.add_argument_group(title="parameters")
+    par_tracks.add_argument('--out', dest='out_path', required=True, type=str,
+                            help='Path to the output feature table')
+    par_tracks.add_argument('--jobs', dest='n_jobs', required=False, type=int,
+                            help='Number of tracks processed in parallel [optional]', default=1)
     args = parser.parse_args()
     ###
     # Check and modify args
@@ -131,6 +278,13 @@ def main():
                 fi_path=args.fi_path,
                 kfold=args.kfold,
                 save_pred=args.pred,
+                n_jobs=args.n_jobs,
+                profile=args.profile,
+                dtype=args.dtype,
+                init_path=args.init_path,
+                init_mode=args.init_mode,
+                checkpoint=args.checkpoint,
+                resume=args.resume,
                 param_path=args.param_path,
                 project_name=args.project_name,
                 out_dir=args.out_dir)
@@ -144,7 +298,46 @@ def main():
                        scale=args.scale,
                        use_gmean=args.use_gmean,
                        project_name=args.project_name,
-                       out_dir=args.out_dir)
+                       out_dir=args.out_dir,
+                       chunk_size=args.chunk_size,
+                       cache_dir=args.cache_dir,
+                       cache_size=args.cache_size,
+                       n_jobs=args.n_jobs,
+                       profile=args.profile,
+                       dtype=args.dtype)
+    elif args.subcommand == 'convert':
+        save_feature_store(X_path=args.X_path,
+                           out_path=args.out_path,
+                           chunk_size=args.chunk_size,
+                           dtype=args.dtype)
+    elif args.subcommand == 'prepare':
+        make_response(mut_path=args.mut_path,
+                      ele_path=args.ele_path,
+                      callable_path=args.callable_path,
+                      out_path=args.out_path,
+                      chunk_size=args.chunk_size,
+                      matrix_path=args.matrix_path)
+    elif args.subcommand == 'subset':
+        subset_response(matrix_path=args.matrix_path,
+                        donor_path=args.donor_path,
+                        exclude=args.exclude,
+                        out_path=args.out_path)
+    elif args.subcommand == 'features':
+        if args.feature_type == 'nuc':
+            make_nuc_features(ele_path=args.ele_path,
+                              genome_path=args.genome_path,
+                              out_path=args.out_path,
+                              callable_path=args.callable_path,
+                              n_jobs=args.n_jobs)
+        elif args.feature_type == 'tracks':
+            make_track_features(ele_path=args.ele_path,
+                                track_paths=args.track_paths,
+                                out_path=args.out_path,
+                                callable_path=args.callable_path,
+                                n_jobs=args.n_jobs)
+        else:
+            logger.error('Please specify a feature type. See driverpower features -h')
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+""" Genomic intervals with sorted NumPy arrays.
+
+Intervals are 0-based and half-open as in BED. Two intervals overlap if
+start1 < end2 and start2 < end1. All functions work on one chromosome;
+tables are split by chromosome with split_chrom.
+
+"""
+import gzip
+import numpy as np
+import pandas as pd
+
+
+def read_bed(path, usecols, names, chunk_size=None):
+    """ Read a headless BED-like file (can be compressed).
+
+    Args:
+        path (str): path to the file.
+        usecols (list): column indices.
+        names (list): column names of usecols. start and end are read as int,
+            value as float and others as str.
+        chunk_size (int): number of lines per chunk. None to read all lines at once.
+
+    Returns:
+        pd.df or iterator of pd.df: the table (or chunks) with columns in names.
+
+    """
+    names = dict(zip(usecols, names))
+    dtype = {i: np.int64 if name in ('start', 'end') else np.float64 if name == 'value' else str
+             for i, name in names.items()}
+    reader = pd.read_csv(path, sep='\t', header=None, comment='#', skiprows=_count_header(path),
+                         usecols=usecols, dtype=dtype, chunksize=chunk_size)
+    if chunk_size is None:
+        return reader.rename(columns=names)
+    return (chunk.rename(columns=names) for chunk in reader)
+
+
+def _count_header(path):
+    """ Number of leading track and browser lines (e.g., in bedGraph)."""
+    ct = 0
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as f:
+        for line in f:
+            if not line.startswith(('track', 'browser')):
+                break
+            ct += 1
+    return ct
+
+
+def split_chrom(chrom):
+    """ Row indices per chromosome.
+
+    Args:
+        chrom (np.array): chromosome of each row.
+
+    Returns:
+        dict: {chrom: np.array of row indices}.
+
+    """
+    codes, uniques = pd.factorize(chrom)
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+    return {c: order[s:e] for c, s, e in zip(uniques, np.r_[0, bounds[:-1]], bounds)}
+
+
+def merge_intervals(start, end):
+    """ Merge overlapping and book-ended intervals.
+
+    Args:
+        start (np.array): start positions.
+        end (np.array): end positions.
+
+    Returns:
+        np.array: sorted start positions of merged intervals.
+        np.array: end positions of merged intervals.
+
+    """
+    order = np.argsort(start, kind='mergesort')
+    start = np.asarray(start)[order]
+    end = np.maximum.accumulate(np.asarray(end)[order])
+    # a new interval begins where start is after all previous ends
+    is_new = np.r_[True, start[1:] > end[:-1]]
+    is_last = np.r_[is_new[1:], True]
+    return start[is_new], end[is_last]
+
+
+def intersect_merged(start, end, m_start, m_end):
+    """ Intersect intervals with sorted, non-overlapping (merged) intervals.
+
+    Args:
+        start (np.array): start positions of query intervals.
+        end (np.array): end positions of query intervals.
+        m_start (np.array): start positions of merged intervals.
+        m_end (np.array): end positions of merged intervals.
+
+    Returns:
+        np.array: index of the query interval of each overlapping piece.
+        np.array: start positions of pieces.
+        np.array: end positions of pieces.
+
+    """
+    # merged intervals in [lo, hi) overlap the query
+    lo = np.searchsorted(m_end, start, side='right')
+    hi = np.searchsorted(m_start, end, side='left')
+    q_ix, m_ix = _expand(lo, hi)
+    return q_ix, np.maximum(start[q_ix], m_start[m_ix]), np.minimum(end[q_ix], m_end[m_ix])
+
+
+def overlap_pairs(q_start, q_end, start, end):
+    """ Find all overlapping pairs of query and target intervals.
+
+    Targets can overlap each other. Candidates are located by binary search on
+    target starts and the running maximum of target ends, then checked for overlap.
+
+    Args:
+        q_start (np.array): start positions of query intervals.
+        q_end (np.array): end positions of query intervals.
+        start (np.array): start positions of targets, sorted.
+        end (np.array): end positions of targets.
+
+    Returns:
+        np.array: query index of each pair.
+        np.array: target index of each pair.
+
+    """
+    # targets before lo end before the query starts; targets from hi start after the query ends
+    lo = np.searchsorted(np.maximum.accumulate(end), q_start, side='right')
+    hi = np.searchsorted(start, q_end, side='left')
+    q_ix, t_ix = _expand(lo, hi)
+    keep = end[t_ix] > q_start[q_ix]
+    return q_ix[keep], t_ix[keep]
+
+
+def _expand(lo, hi):
+    """ Expand ranges [lo, hi) of each row into (row, index) pairs."""
+    counts = np.maximum(hi - lo, 0)
+    row = np.repeat(np.arange(lo.shape[0]), counts)
+    offset = np.arange(row.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    return row, np.repeat(lo, counts) + offset
@@ -6,26 +6,35 @@ Two types of BMR model are supported:
 
 """
 
+import functools
+import json
 import logging
+import multiprocessing.pool
+import os
 import sys
+import threading
 import numpy as np
 import pandas as pd
 from scipy import stats
 from sklearn.preprocessing import RobustScaler
-from sklearn.linear_model import LassoCV, RandomizedLasso
+from sklearn.linear_model import Lasso, LassoCV
 from sklearn.model_selection import KFold
-from sklearn.utils import resample
 from sklearn.metrics import r2_score, explained_variance_score
 from scipy.special import logit
-from driverpower.dataIO import read_feature, read_response, read_fi, read_param
+from driverpower.dataIO import read_feature, read_response, read_fi, read_param, read_model, read_folds
+from driverpower.dataIO import is_feature_store, open_store_matrix
 from driverpower.dataIO import save_fi, save_prediction, save_model
+from driverpower.binindex import align_bins, find_bins
+from driverpower.glm import fit_glm
+from driverpower.checkpoint import checkpoint_dir, start_checkpoint, read_checkpoint_folds, remove_checkpoint
+from driverpower.checkpoint import read_fold_checkpoint, resume_early_stopping, history_rounds, FoldCheckpoint
+from driverpower.checkpoint import sampling_params
+from driverpower.profiler import start_profile, stage, save_report, round_timer, add_gbm_rounds
 import warnings
 with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=FutureWarning)
     warnings.filterwarnings("ignore", category=DeprecationWarning)
     import xgboost as xgb
-    import statsmodels.api as sm
-    import statsmodels
 
 
 logger = logging.getLogger('MODEL')
@@ -35,7 +44,8 @@ def run_bmr(model_name, X_path, y_path,
             fi_cut=0.5, fi_path=None,
             kfold=3, param_path=None,
             project_name='DriverPower', out_dir='./DriverPower.output/',
-            save_pred=False):
+            save_pred=False, n_jobs=1, profile=False, dtype='float64',
+            init_path=None, init_mode='continue', checkpoint=0, resume=False):
     """ Wrapper function for BMR model.
 
     Args:
@@ -49,15 +59,38 @@ def run_bmr(model_name, X_path, y_path,
         project_name (str): name of the project
         out_dir (str): directory for saving output files
         save_pred (bool): save the prediction for training set
+        n_jobs (int): number of worker threads for GBM folds or randomized lasso resampling
+        profile (bool): save time and memory usage of each stage to [project_name].run_report.json
+        dtype (str): data type of features, 'float64' or 'float32'. float32 halves the memory of X;
+            GLM coefficients are still fitted in float64.
+        init_path (str): path to a previous GBM model. Its boosters are updated with the new data
+            and bins keep their folds. New features are appended after features of the previous model.
+        init_mode (str): 'continue' to add boosting rounds or 'refresh' to refit leaf values of existing trees.
+        checkpoint (int): save GBM boosters every checkpoint rounds to [project_name].GBM.checkpoint
+            in out_dir, removed after the model is saved. 0 to disable.
+        resume (bool): resume GBM training from the checkpoint in out_dir.
 
     Returns:
 
     """
+    if profile:
+        start_profile('model')
+    init_model = None
+    if init_path is not None:
+        if model_name != 'GBM':
+            logger.error('--initModel is only supported for GBM')
+            sys.exit(1)
+        init_model = read_model(init_path)
+        if init_model['model_name'] != 'GBM':
+            logger.error('Initial model {} is not a GBM'.format(init_path))
+            sys.exit(1)
+        if kfold != init_model['kfold']:
+            logger.warning('Use {} folds of the initial model'.format(init_model['kfold']))
+            kfold = init_model['kfold']
     use_features = read_fi(fi_path, fi_cut)
     run_feature_select = False if use_features else True
-    X = read_feature(X_path, use_features)
-    y = read_response(y_path)
-    feature_names = X.columns.values
+    with stage('read_response'):
+        y = read_response(y_path)
     # down-sampling 0 mutation elements
     pct_zero = y[y.nMut == 0].shape[0] / y.shape[0] * 100
     pct_req = 0.1
@@ -69,41 +102,69 @@ def run_bmr(model_name, X_path, y_path,
         y_zero = y_zero.sample(n=ct_req, replace=False)
         y = pd.concat([y_nonzero, y_zero])
         del y_nonzero, y_zero
+    y = y.loc[y.length>=100, :]
+    # GLM with known features is fitted from a feature store by row blocks, without loading X
+    out_of_core = model_name in ('Binomial', 'NegativeBinomial') and not run_feature_select \
+        and is_feature_store(X_path)
+    # only load features for usable bins
+    with stage('read_feature'):
+        if out_of_core:
+            logger.info('Fit GLM by row blocks of the feature store')
+            X = open_store_matrix(X_path, use_features, use_bins=y.index.values, dtype=dtype)
+        else:
+            X = read_feature(X_path, use_features, use_bins=y.index.values, dtype=dtype)
+    cols = np.arange(X.shape[1])
+    if init_model is not None:
+        # features of the initial model first, then new features
+        init_cols = X.columns.get_indexer(init_model['feature_names'])
+        if np.any(init_cols < 0):
+            logger.error('Features of the initial model not found: {}'.format(
+                ', '.join(init_model['feature_names'][init_cols < 0])))
+            sys.exit(1)
+        cols = np.r_[init_cols, np.setdiff1d(cols, init_cols)]
+        logger.info('{} new features are appended to {} features of the initial model'.format(
+            cols.shape[0] - init_cols.shape[0], init_cols.shape[0]))
+    feature_names = X.columns.values[cols]
     # use bins with both X and y
-    use_bins = np.intersect1d(X.index.values, y.loc[y.length>=100, :].index.values)
+    use_bins, (x_rows, y_rows) = align_bins(X.index.values, y.index.values)
     logger.info('Use {} bins in model training'.format(use_bins.shape[0]))
-    X = X.loc[use_bins, :].values  # X is np.array now
-    y = y.loc[use_bins, :]
+    X = X.take(x_rows, cols) if out_of_core else X.values[np.ix_(x_rows, cols)]  # X is np.array now
+    y = y.iloc[y_rows, :]
     if model_name in ('Binomial', 'NegativeBinomial'):
         # Scale data is necessary for GLM
-        X, scaler = scale_data(X)
+        with stage('scale_data'):
+            if out_of_core:
+                # row blocks are scaled when read
+                scaler = fit_scaler_by_column(X)
+            else:
+                X, scaler = scale_data(X)
         if run_feature_select:
             # Run lasso to get alpha
-            alpha = run_lasso(X, y)
+            with stage('lasso'):
+                alpha, coef = run_lasso(X, y, n_threads=n_jobs)
             # Run rnd lasso to get feature importance
-            fi_scores = run_rndlasso(X, y, alpha)
+            with stage('randomized_lasso'):
+                fi_scores = run_rndlasso(X, y, alpha, coef_init=coef, n_threads=n_jobs)
             fi = save_fi(fi_scores, feature_names, project_name, out_dir)
             # Remove unimportant features
             keep = (fi.importance >= fi_cut).values
             use_features = fi.name.values[keep]
             X = X[:, np.isin(feature_names, use_features)]
         # Run GLM to get trained model
-        model = run_glm(X, y, model_name)
-        yhat = (model.fittedvalues * y.length * y.N).values if model_name == 'Binomial' else model.fittedvalues
+        with stage('glm'):
+            coef, mu, scale = run_glm(X, y, model_name, scaler if out_of_core else None)
+        del X
+        yhat = mu * (y.length * y.N).values if model_name == 'Binomial' else mu
         # report metrics
         report_metrics(yhat, y.nMut.values)
         if save_pred:
             save_prediction(yhat, y, project_name, out_dir, model_name)
         # Run dispersion test
-        pval, theta = dispersion_test(yhat, y.nMut.values) if model_name == 'Binomial' else (0, model.scale)
-        # remove actual data from GLM model; save space
-        with warnings.catch_warnings():
-            # https://github.com/statsmodels/statsmodels/issues/3563
-            warnings.filterwarnings('ignore', category=statsmodels.CacheWriteWarning)
-            model.remove_data()
+        with stage('dispersion_test'):
+            pval, theta = dispersion_test(yhat, y.nMut.values) if model_name == 'Binomial' else (0, scale)
         # Save model info.
         model_info = {'model_name': model_name,
-                      'model': model,
+                      'coef': coef,
                       'scaler': scaler,
                       'pval_dispersion': pval,
                       'theta': theta,
@@ -113,36 +174,51 @@ def run_bmr(model_name, X_path, y_path,
     elif model_name == 'GBM':
         # calculate base margin
         offset = np.array(np.log(y.length+1/y.N) + np.log(y.N))
-        # k-fold CV
-        ks = KFold(n_splits=kfold)
-        param = read_param(param_path)
-        yhat = np.zeros(y.shape[0])
-        k = 1  # idx of model fold
-        fi_scores_all = pd.DataFrame(np.nan, columns=['fold' + str(i) for i in range(1, kfold+1)], index=feature_names)
-        # model dict (key is the fold and value is the booster
-        model = dict()
-        X_dict = dict()  # dict to hold X for each fold (key)
-        X_idx = dict()  # dict to hold index of X for each fold (key)
-        # split data into k fold
-        for valid, train in ks.split(range(X.shape[0])):
-            logger.info('Split data fold {}/{}'.format(k, kfold))
-            X_dict[k] = xgb.DMatrix(data=X[train, :], label=y.nMut.values[train], feature_names=feature_names)
-            X_idx[k] = train
-            # add offset
-            X_dict[k].set_base_margin(offset[train])
-            k += 1
+        if init_model is not None and param_path is None:
+            param = dict(init_model['params'])
+        else:
+            param = read_param(param_path)
+        ck_path = checkpoint_dir(out_dir, project_name)
+        if init_mode == 'refresh' and init_model is not None and (checkpoint > 0 or resume):
+            logger.info('Checkpoints are not used with --initMode refresh')
+            checkpoint, resume = 0, False
+        ck_folds = None
+        if resume:
+            ck_folds = read_checkpoint_folds(ck_path)
+            if ck_folds is None:
+                logger.warning('No checkpoint found in {}. Train from the first round'.format(ck_path))
+                resume = False
+            elif ck_folds[1].max() != kfold:
+                logger.error('Checkpoint has {} folds but kfold is {}'.format(ck_folds[1].max(), kfold))
+                sys.exit(1)
+        if ck_folds is not None:
+            logger.info('Resume GBM training from {}'.format(ck_path))
+            sampling = sampling_params(param)
+            if sampling:
+                logger.warning('Resumed rounds are not identical to an uninterrupted run with {}: '
+                               'subsampling draws different rows and columns, so the model and '
+                               'the early stopping round may differ'.format(
+                                   ', '.join('{}={}'.format(k, v) for k, v in sorted(sampling.items()))))
+            fold = init_folds(y.index.values, ck_folds, kfold)
+        elif init_model is None:
+            fold = make_folds(y.shape[0], kfold)
+        else:
+            fold = init_folds(y.index.values, read_folds(init_path), kfold)
+        init_boosters = None
+        if init_model is not None:
+            init_boosters = {k: widen_booster(init_model['model'][k], feature_names) for k in range(1, kfold+1)}
+        if checkpoint > 0:
+            start_checkpoint(ck_path, y.index.values, fold, resume=resume)
+        # build DMatrix once; folds are slices of it
+        with stage('dmatrix'):
+            data = xgb.DMatrix(data=X, label=y.nMut.values, feature_names=list(feature_names))
+            data.set_base_margin(offset)
         del X
-        # train and predict
-        for k in range(1, kfold+1):
-            logger.info('Training GBM fold {}/{}'.format(k, kfold))
-            # data fold used in validation
-            k_valid = k + 1 if k < kfold else 1
-            # train with fold k and valid with k_valid
-            model[k] = run_gbm(X_dict[k], X_dict[k_valid], param)
-            # predict on valid
-            yhat[X_idx[k_valid]] = model[k].predict(X_dict[k_valid])
-            # get feature importance score
-            fi_scores_all['fold' + str(k)] = pd.Series(model[k].get_score(importance_type='gain'))
+        # k-fold CV
+        with stage('gbm'):
+            model, yhat, fi_scores_all = run_gbm_cv(data, kfold, param, n_jobs, fold, init_boosters, init_mode,
+                                                    ck_path, checkpoint, resume)
+        del data
         # Save feature importance result
         fi_scores_all.fillna(0, inplace=True)
         fi_scores = fi_scores_all.mean(axis=1).values  # get average score for each feature
@@ -152,7 +228,8 @@ def run_bmr(model_name, X_path, y_path,
         if save_pred:
             save_prediction(yhat, y, project_name, out_dir, model_name)
         # Run dispersion test
-        pval, theta = dispersion_test(yhat, y.nMut.values)
+        with stage('dispersion_test'):
+            pval, theta = dispersion_test(yhat, y.nMut.values)
         model_info = {'model_name': model_name,
                       'model': model,
                       'pval_dispersion': pval,
@@ -160,17 +237,22 @@ def run_bmr(model_name, X_path, y_path,
                       'kfold': kfold,
                       'params': param,
                       'feature_names': feature_names,
+                      'folds': (y.index.values, fold),
                       'project_name': project_name,
                       'model_dir': out_dir}
     else:
         logger.error('Unknown background model: {}. Please use Binomial, NegativeBinomial or GBM'.format(model_name))
         sys.exit(1)
-    save_model(model_info, project_name, out_dir, model_name)
+    with stage('save_model'):
+        save_model(model_info, project_name, out_dir, model_name)
+    if model_name == 'GBM':
+        remove_checkpoint(checkpoint_dir(out_dir, project_name))
+    save_report(project_name, out_dir)
     logger.info('Job done!')
 
 
 def scale_data(X, scaler=None):
-    """ Scale X with robust scaling.
+    """ Scale X with robust scaling. X is scaled in place and keeps its float type.
     
     Args:
         X (np.array): feature matrix indexed by binID.
@@ -190,6 +272,27 @@ def scale_data(X, scaler=None):
         return scaler.transform(X), scaler
 
 
+def fit_scaler_by_column(X):
+    """ Fit robust scaling one column at a time, for X not held in memory.
+
+    Args:
+        X (StoreMatrix): feature matrix with column(j).
+
+    Returns:
+        RobustScaler: robust scaler, same as fitted with the whole X.
+
+    """
+    center = np.zeros(X.shape[1])
+    scale = np.ones(X.shape[1])
+    for j in range(X.shape[1]):
+        col_scaler = RobustScaler().fit(X.column(j).reshape(-1, 1))
+        center[j], scale[j] = col_scaler.center_[0], col_scaler.scale_[0]
+    scaler = RobustScaler()
+    scaler.center_ = center
+    scaler.scale_ = scale
+    return scaler
+
+
 def run_lasso(X, y, max_iter=3000, cv=5, n_threads=1):
     """ Implement LassoCV in sklearn
     
@@ -202,31 +305,42 @@ def run_lasso(X, y, max_iter=3000, cv=5, n_threads=1):
 
     Returns:
         float: trained alpha value.
+        np.array: lasso coefficients at alpha, used to warm start randomized lasso.
 
     """
     logger.info('Implementing LassoCV with {} iter. and {}-fold CV'.format(max_iter, cv))
     # generate logit response
     y_logit = logit((y.nMut + 0.5) / (y.length * y.N))
     # sub-sampling X and y (300,000)
-    use_ix = np.random.choice(y_logit.shape[0], 300000, replace=False)
+    use_ix = np.random.choice(y_logit.shape[0], min(300000, y_logit.shape[0]), replace=False)
     Xsub = X[use_ix, :]
     ysub = y_logit[use_ix]
     reg = LassoCV(max_iter=max_iter, cv=cv, copy_X=False, n_jobs=n_threads)
     lassocv = reg.fit(Xsub, ysub)
     logger.info('LassoCV alpha = {}'.format(lassocv.alpha_))
-    return lassocv.alpha_
+    return lassocv.alpha_, lassocv.coef_
 
 
 def run_rndlasso(X, y, alpha,
-    n_resampling=500, sample_fraction=0.1, n_threads=1):
-    """  Implement Randomized Lasso in sklearn
+    n_resampling=500, sample_fraction=0.1, scaling=0.5,
+    coef_init=None, max_iter=3000, n_threads=1):
+    """ Stability selection with randomized lasso.
+
+    Each resampling fits a lasso on a random subsample of bins, with each feature
+    randomly down-weighted by ``scaling``. The importance score of a feature is the
+    fraction of resamplings that select it. Resamplings run in n_threads worker threads
+    sharing X (the lasso solver releases the GIL), and each lasso is warm started from coef_init.
 
     Args:
-        X (np.array): scaled X. 
-        y (pd.df): four columns response table. 
-        alpha (float): parameter trained from lassoCV 
-        n_resampling (int): number of times for resampling 
+        X (np.array): scaled X.
+        y (pd.df): four columns response table.
+        alpha (float): parameter trained from lassoCV
+        n_resampling (int): number of times for resampling
         sample_fraction (float): fraction of data to use at each resampling
+        scaling (float): weight reduction of randomly down-weighted features, in (0, 1)
+        coef_init (np.array): lasso coefficients at alpha. Default is zeros
+        max_iter (int): max iteration.
+        n_threads (int): number of worker threads.
 
     Returns:
         np.array: feature importance scores
@@ -235,51 +349,182 @@ def run_rndlasso(X, y, alpha,
     logger.info('Implementing Randomized Lasso with alpha={}, n_resampling={} and sample_fraction={}'.
                 format(alpha, n_resampling, sample_fraction))
     # generate logit response
-    y_logit = logit((y.nMut + 0.5) / (y.length * y.N))
-    reg = RandomizedLasso(alpha=alpha,
-                          n_resampling=n_resampling,
-                          sample_fraction=sample_fraction,
-                          selection_threshold=1e-3,
-                          max_iter=3000,
-                          normalize=False,
-                          n_jobs=n_threads)
-    rndlasso = reg.fit(X, y_logit)
-    fi_scores = rndlasso.scores_
+    y_logit = logit((y.nMut + 0.5) / (y.length * y.N)).values
+    coef_init = np.zeros(X.shape[1]) if coef_init is None else coef_init
+    # one seed per resampling, so results do not depend on n_threads
+    seeds = np.random.randint(np.iinfo(np.int32).max, size=n_resampling)
+    n_threads = max(1, min(n_threads, n_resampling))
+    # data shared by worker threads
+    lasso_data = dict(X=X, y=y_logit, alpha=alpha, seeds=seeds, sample_fraction=sample_fraction,
+                      scaling=scaling, coef_init=coef_init, max_iter=max_iter)
+    if n_threads == 1:
+        selected = [_fit_resample(lasso_data, i) for i in range(n_resampling)]
+    else:
+        with multiprocessing.pool.ThreadPool(n_threads) as pool:
+            selected = pool.map(functools.partial(_fit_resample, lasso_data), range(n_resampling),
+                                chunksize=max(1, n_resampling // (4 * n_threads)))
+    fi_scores = np.mean(selected, axis=0)
     return fi_scores
 
 
-def run_glm(X, y, model_name):
+def _fit_resample(lasso_data, i):
+    """ Fit lasso on resampling i and return selected features. Data are read from lasso_data (see run_rndlasso)."""
+    X = lasso_data['X']
+    rs = np.random.RandomState(lasso_data['seeds'][i])
+    n_sample, n_feature = X.shape
+    n_sub = int(lasso_data['sample_fraction'] * n_sample)
+    use_ix = np.sort(rs.choice(n_sample, n_sub, replace=False))
+    # each feature is kept with weight 1 or down-weighted with 1 - scaling
+    weights = 1. - lasso_data['scaling'] * rs.randint(0, 2, size=n_feature)
+    Xsub = X[use_ix, :] * weights
+    reg = Lasso(alpha=lasso_data['alpha'], max_iter=lasso_data['max_iter'], warm_start=True, copy_X=False)
+    # same fit on weighted features has coefficients scaled by 1 / weights
+    reg.coef_ = lasso_data['coef_init'] / weights
+    reg.fit(Xsub, lasso_data['y'][use_ix])
+    return reg.coef_ != 0
+
+
+def run_glm(X, y, model_name, scaler=None):
     """ Train the binomial/negative binomial GLM
-    
+
+    The GLM is fitted by IRLS on row blocks of X (see glm.fit_glm),
+    with the same coefficients as statsmodels GLM.
+
     Args:
-        X (np.array): scaled X. 
+        X (np.array): scaled X, or unscaled X (e.g., StoreMatrix) with scaler.
         y (pd.df): four columns response table.
+        model_name (str): 'Binomial' or 'NegativeBinomial'.
+        scaler (RobustScaler): scaler applied to row blocks of unscaled X.
 
     Returns:
-        sm.model: trained GLM models.
-        
+        np.array: GLM coefficients, intercept last.
+        np.array: fitted mean; probability for Binomial and count for NegativeBinomial.
+        float: scale.
+
     """
-    # Add const manually. sm.add_constant cannot add 1 for shape (1, n)
-    X = np.c_[X, np.ones(X.shape[0])]
     if model_name == 'Binomial':
+        # nMut successes in length * N trials
         logger.info('Building binomial GLM')
-        # make two columns response (# success, # failure)
-        y_binom = np.zeros((y.shape[0], 2), dtype=np.int_)
-        y_binom[:, 0] = y.nMut
-        y_binom[:, 1] = y.length * y.N - y.nMut
-        glm = sm.GLM(y_binom, X, family=sm.families.Binomial())
     elif model_name == 'NegativeBinomial':
+        # use nMut as response and length*N+1 as exposure
         logger.info('Building negative binomial GLM')
-        # use nMut as response and length*N as exposure
-        glm = sm.GLM(y.nMut.values, X, family=sm.families.NegativeBinomial(), exposure=y.length.values*y.N.values+1)
     else:
         sys.stderr.write('Unknown GLM name {}. Must be Binomial or NegativeBinomial'.format(model_name))
         sys.exit(1)
-    model = glm.fit()
-    return model
+    return fit_glm(X, y, model_name, scaler)
+
+
+def run_gbm_cv(data, kfold, param, n_jobs=1, fold=None, init_boosters=None, init_mode='continue',
+               checkpoint_path=None, checkpoint_interval=0, resume=False):
+    """ Train k-fold GBM, with n_jobs folds in parallel.
+
+    The booster of fold k is trained with data fold k and validated with data fold k+1.
+    Data folds are row slices of one shared DMatrix, made only when the fold is used,
+    so memory does not grow with the number of folds.
+    Parallel folds run in worker threads, since xgboost releases the GIL while training.
+    Worker processes are not used: forking after xgboost has run OpenMP threads
+    deadlocks the workers. Threads in param['nthread'] are split among n_jobs parallel folds.
 
+    Args:
+        data (xgb.DMatrix): all training data with label and base margin.
+        kfold (int): number of folds.
+        param (dict): parameters for xgboost.
+        n_jobs (int): number of folds trained in parallel.
+        fold (np.array): fold (1 to kfold) of each row. None for consecutive folds (see make_folds).
+        init_boosters (dict): boosters keyed by fold to start from. None to train from scratch.
+        init_mode (str): 'continue' to add boosting rounds to init_boosters,
+            or 'refresh' to refit their leaf values.
+        checkpoint_path (str): directory of fold checkpoints.
+        checkpoint_interval (int): save boosters every checkpoint_interval rounds. 0 to disable.
+        resume (bool): resume each fold from its checkpoint. Finished folds are not trained again.
+
+    Returns:
+        dict: boosters keyed by fold.
+        np.array: out-of-fold predictions.
+        pd.df: gain feature importance per fold.
 
-def run_gbm(dtrain, dvalid, param):
+    """
+    if fold is None:
+        fold = make_folds(data.num_row(), kfold)
+    fold_idx = {k: np.where(fold == k)[0] for k in range(1, kfold+1)}  # index of data for each fold (key)
+    n_jobs = max(1, min(n_jobs, kfold))
+    fold_param = dict(param)
+    fold_param['nthread'] = max(1, param.get('nthread', os.cpu_count()) // n_jobs)
+    # data shared by worker threads
+    fold_data = dict(data=data, slice_lock=threading.Lock(), fold_idx=fold_idx, kfold=kfold, param=fold_param,
+                     init_boosters=init_boosters, init_mode=init_mode, checkpoint_path=checkpoint_path,
+                     checkpoint_interval=checkpoint_interval, resume=resume)
+    if n_jobs == 1:
+        res = [_train_fold(fold_data, k) for k in range(1, kfold+1)]
+    else:
+        logger.info('Training {} GBM folds in parallel with {} threads each'.format(n_jobs, fold_param['nthread']))
+        with multiprocessing.pool.ThreadPool(n_jobs) as pool:
+            res = pool.map(functools.partial(_train_fold, fold_data), range(1, kfold+1))
+    # gather boosters, predictions and feature importance
+    model = dict()  # model dict (key is the fold and value is the booster
+    yhat = np.zeros(data.num_row())
+    fi_scores_all = pd.DataFrame(np.nan, columns=['fold' + str(i) for i in range(1, kfold+1)],
+                                 index=data.feature_names)
+    for k, bst, pred, fi, rounds in res:
+        model[k] = bst
+        add_gbm_rounds(k, rounds)
+        k_valid = k + 1 if k < kfold else 1
+        yhat[fold_idx[k_valid]] = pred
+        fi_scores_all['fold' + str(k)] = pd.Series(fi)
+    return model, yhat, fi_scores_all
+
+
+def _train_fold(fold_data, k):
+    """ Train fold k and predict on its validation fold. Data are read from fold_data (see run_gbm_cv)."""
+    kfold = fold_data['kfold']
+    logger.info('Training GBM fold {}/{}'.format(k, kfold))
+    # data fold used in validation
+    k_valid = k + 1 if k < kfold else 1
+    # the shared DMatrix is sliced by one thread at a time
+    with fold_data['slice_lock']:
+        dtrain = fold_data['data'].slice(fold_data['fold_idx'][k])
+        dvalid = fold_data['data'].slice(fold_data['fold_idx'][k_valid])
+    # train with fold k and valid with k_valid
+    timer = round_timer()
+    param = fold_data['param']
+    init_bst = None
+    if fold_data['init_boosters'] is not None:
+        init_bst = fold_data['init_boosters'][k]
+        if fold_data['init_mode'] == 'refresh':
+            # refit leaf values of existing trees; no new trees
+            param = dict(param, process_type='update', updater='refresh', refresh_leaf=True,
+                         num_boost_round=init_bst.num_boosted_rounds(), early_stopping_rounds=None)
+    callbacks = [] if timer is None else [timer]
+    history, finished = None, False
+    if fold_data['resume']:
+        ck_bst, history, finished = read_fold_checkpoint(fold_data['checkpoint_path'], k)
+        if ck_bst is not None:
+            init_bst = ck_bst
+            n_done = history_rounds(history)
+            param = dict(param, num_boost_round=param.get('num_boost_round', 5000) - n_done)
+            early_stop = param.get('early_stopping_rounds', 5)
+            if early_stop is not None and not finished:
+                # early stopping continues from the eval history of the checkpoint
+                es, finished = resume_early_stopping(init_bst, history, early_stop)
+                param['early_stopping_rounds'] = None
+                callbacks.append(es)
+            finished = finished or param['num_boost_round'] <= 0
+            logger.info('Fold {}: {} rounds in checkpoint{}'.format(k, n_done, ', finished' if finished else ''))
+    if finished:
+        bst = init_bst
+    else:
+        if fold_data['checkpoint_interval'] > 0:
+            callbacks.append(FoldCheckpoint(fold_data['checkpoint_path'], k, fold_data['checkpoint_interval'],
+                                            history))
+        bst = run_gbm(dtrain, dvalid, param, callbacks=callbacks if callbacks else None, xgb_model=init_bst)
+    # predict on valid
+    pred = bst.predict(dvalid)
+    # get feature importance score
+    fi = bst.get_score(importance_type='gain')
+    return k, bst, pred, fi, None if timer is None else timer.rounds
+
+
+def run_gbm(dtrain, dvalid, param, callbacks=None, xgb_model=None):
     # check training arguments in param
     n_round = param.get('num_boost_round', 5000)
     early_stop = param.get('early_stopping_rounds', 5)
@@ -291,11 +536,84 @@ def run_gbm(dtrain, dvalid, param):
                     num_boost_round=n_round,
                     evals=watchlist,
                     early_stopping_rounds=early_stop,
-                    verbose_eval = verbose_eval
+                    verbose_eval = verbose_eval,
+                    callbacks=callbacks,
+                    xgb_model=xgb_model
                    )
     return bst
 
 
+def make_folds(n_row, kfold):
+    """ Split rows into kfold consecutive folds.
+
+    Args:
+        n_row (int): number of rows.
+        kfold (int): number of folds.
+
+    Returns:
+        np.array: fold (1 to kfold) of each row.
+
+    """
+    fold = np.zeros(n_row, dtype=np.int_)
+    for k, (train, valid) in enumerate(KFold(n_splits=kfold).split(np.arange(n_row)), 1):
+        logger.info('Split data fold {}/{}'.format(k, kfold))
+        fold[valid] = k
+    return fold
+
+
+def init_folds(bins, prev_folds, kfold):
+    """ Folds of bins from a previous model. New bins are spread over folds in turn.
+
+    Args:
+        bins (np.array): binIDs of rows.
+        prev_folds (tuple): (binIDs, folds) of the previous model. None if not saved.
+        kfold (int): number of folds.
+
+    Returns:
+        np.array: fold (1 to kfold) of each row.
+
+    """
+    if prev_folds is None:
+        logger.warning('Folds are not saved in the initial model. Use consecutive folds')
+        return make_folds(bins.shape[0], kfold)
+    rows = find_bins(prev_folds[0], bins)
+    fold = np.where(rows >= 0, prev_folds[1][rows], 0)
+    is_new = fold == 0
+    fold[is_new] = np.arange(is_new.sum()) % kfold + 1
+    logger.info('{} bins keep their folds; {} new bins'.format((~is_new).sum(), is_new.sum()))
+    return fold
+
+
+def widen_booster(bst, feature_names):
+    """ Make a booster accept new features appended after its features.
+
+    Existing trees only split on the first features, so the booster is unchanged
+    except for the number and names of features in its JSON model.
+
+    Args:
+        bst (xgb.Booster): trained booster.
+        feature_names (np.array): features of the booster followed by new features.
+
+    Returns:
+        xgb.Booster: booster with feature_names.
+
+    """
+    n_old = bst.num_features()
+    if bst.feature_names is not None and list(bst.feature_names) != list(feature_names[:n_old]):
+        raise ValueError('Features of the booster must come first in feature_names')
+    if n_old == len(feature_names):
+        return bst
+    model = json.loads(bytes(bst.save_raw('json')).decode())
+    learner = model['learner']
+    learner['learner_model_param']['num_feature'] = str(len(feature_names))
+    learner['feature_names'] = [str(i) for i in feature_names]
+    learner['feature_types'] = (learner.get('feature_types') or ['float'] * n_old) + \
+        ['float'] * (len(feature_names) - n_old)
+    for tree in learner['gradient_booster']['model']['trees']:
+        tree['tree_param']['num_feature'] = str(len(feature_names))
+    return xgb.Booster(model_file=bytearray(json.dumps(model).encode()))
+
+
 def report_metrics(yhat, y):
     # report metrics of training set
     r2 = r2_score(y, yhat)
@@ -304,28 +622,49 @@ def report_metrics(yhat, y):
     logger.info('Model metrics for training set: r2={:.2f}, Variance explained={:.2f}, Pearson\'r={:.2f}'.format(r2, var_exp, r))
 
 
-def dispersion_test(yhat, y, k=100):
+def dispersion_test(yhat, y, k=100, block_size=None):
     """ Implement the regression based dispersion test with k re-sampling.
 
+    For each bootstrap sample, regress (np.power((y - yhat), 2) - yhat) / yhat on yhat
+    without intercept. The slope, its standard error and t-test p-value are computed in
+    closed form for a block of bootstrap samples at a time. Bootstrap sample i is drawn with
+    np.random.RandomState(i), same as sklearn.utils.resample(random_state=i).
+
     Args:
         yhat (np.array): predicted mutation count
         y (np.array): observed mutation count
-        k (int):
+        k (int): number of bootstrap samples.
+        block_size (int): number of bootstrap samples per block. None to use ~8M elements per block.
 
     Returns:
         float, float: p-value, theta
 
     """
+    yhat = np.asarray(yhat, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = y.shape[0]
+    # (np.power((y - yhat), 2) - y) / yhat for Poisson regression
+    aux = (np.power((y - yhat), 2) - yhat) / yhat
+    if block_size is None:
+        block_size = max(1, (1 << 23) // n)
     theta = 0
     pval = 0
-    for i in range(k):
-        y_sub, yhat_sub = resample(y, yhat, random_state=i)
-        # (np.power((y - yhat), 2) - y) / yhat for Poisson regression
-        aux = (np.power((y_sub - yhat_sub), 2) - yhat_sub) / yhat_sub
-        mod = sm.OLS(aux, yhat_sub)
-        res = mod.fit()
-        theta += res.params[0]
-        pval += res.pvalues[0]
+    for start in range(0, k, block_size):
+        # bootstrap index sets, one row per sample
+        idx = np.stack([np.random.RandomState(i).randint(0, n, size=n)
+                        for i in range(start, min(k, start + block_size))])
+        x_sub = yhat[idx]
+        aux_sub = aux[idx]
+        del idx
+        # OLS without intercept: aux = theta * yhat
+        sxx = np.einsum('ij,ij->i', x_sub, x_sub)
+        params = np.einsum('ij,ij->i', x_sub, aux_sub) / sxx
+        aux_sub -= params[:, np.newaxis] * x_sub  # residuals
+        sigma2 = np.einsum('ij,ij->i', aux_sub, aux_sub) / (n - 1)
+        tvalues = params / np.sqrt(sigma2 / sxx)
+        pvalues = 2 * stats.t.sf(np.abs(tvalues), n - 1)
+        theta += params.sum()
+        pval += pvalues.sum()
     theta = theta/k
     pval = pval/k
     return pval, theta
@@ -0,0 +1,173 @@
+""" Prepare the response table.
+
+Count the number of mutations (nMut) and mutated samples (nSample) per element,
+within whitelisted (callable) regions. Mutations are streamed in chunks.
+Counts per element and donor can be saved as a sparse mutation matrix,
+from which response tables of donor subsets are made without re-reading mutations.
+
+"""
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from driverpower.interval import read_bed, split_chrom, merge_intervals, intersect_merged, overlap_pairs
+from driverpower.dataIO import read_mut_matrix, save_mut_matrix
+
+
+logger = logging.getLogger('PREPARE')
+
+
+def make_response(mut_path, ele_path, callable_path, out_path=None, chunk_size=1000000, matrix_path=None):
+    """ Make the response table from mutations, elements and whitelisted regions.
+
+    Elements are intersected with merged whitelisted regions. Each mutation is
+    counted once for every whitelisted element piece it overlaps. Zero-length mutations
+    (insertions) are treated as 1 bp. N is the number of donors in the mutation file.
+
+    Args:
+        mut_path (str): path to mutations (chrom, start, end, ref, alt, donor), no header.
+        ele_path (str): path to elements (chrom, start, end, binID), no header.
+        callable_path (str): path to whitelisted regions (chrom, start, end), no header.
+        out_path (str): path to the output response table. None for no output.
+        chunk_size (int): number of mutations per chunk.
+        matrix_path (str): path to the output mutation matrix directory. None for no output.
+
+    Returns:
+        pd.df: response table indexed by binID, with columns length, nMut, nSample and N.
+
+    """
+    pieces, bins = read_elements(ele_path, callable_path)
+    pairs = []  # (bin, donor) codes
+    counts = []  # number of mutations per pair
+    donors = dict()  # donor to code
+    ct = 0
+    for mut in read_bed(mut_path, [0, 1, 2, 5], ['chrom', 'start', 'end', 'donor'], chunk_size):
+        # encode donors across chunks
+        codes, uniques = pd.factorize(mut.donor.values)
+        for donor in uniques:
+            donors.setdefault(donor, len(donors))
+        donor_code = np.array([donors[i] for i in uniques], dtype=np.int64)[codes]
+        for chrom, ix in split_chrom(mut.chrom.values).items():
+            if chrom not in pieces:
+                continue
+            start = mut.start.values[ix]
+            end = np.maximum(mut.end.values[ix], start + 1)
+            m_ix, p_ix = overlap_pairs(start, end, pieces[chrom]['start'], pieces[chrom]['end'])
+            bin_code = pieces[chrom]['bin'][p_ix]
+            key, ct_key = np.unique((bin_code.astype(np.int64) << 32) | donor_code[ix][m_ix], return_counts=True)
+            pairs.append(key)
+            counts.append(ct_key)
+        ct += mut.shape[0]
+        logger.info('Processed {} mutations'.format(ct))
+    pairs = np.concatenate(pairs) if len(pairs) > 0 else np.zeros(0, dtype=np.int64)
+    counts = np.concatenate(counts) if len(counts) > 0 else np.zeros(0, dtype=np.int64)
+    # bins x donors; duplicated pairs from chunks are summed
+    mat = sparse.csr_matrix((counts.astype(np.int32), (pairs >> 32, pairs & 0xffffffff)),
+                            shape=(bins.shape[0], len(donors)))
+    # effective length; elements without whitelisted bp are removed
+    p_bin = np.concatenate([i['bin'] for i in pieces.values()]) if len(pieces) > 0 else np.zeros(0, dtype=np.int64)
+    p_len = np.concatenate([i['end'] - i['start'] for i in pieces.values()]) if len(pieces) > 0 else np.zeros(0)
+    length = np.bincount(p_bin, weights=p_len, minlength=bins.shape[0])
+    keep = np.bincount(p_bin, minlength=bins.shape[0]) > 0
+    mat = mat[keep, :]
+    bins = bins[keep]
+    length = length[keep].astype(np.int_)
+    # sort donors by name
+    donors = np.array(list(donors.keys()), dtype=str)
+    order = np.argsort(donors, kind='mergesort')
+    mat = mat[:, order]
+    donors = donors[order]
+    if matrix_path is not None:
+        save_mut_matrix(matrix_path, mat, bins, length, donors)
+    y = matrix_to_response(mat, bins, length)
+    logger.info('{} mutations from {} donors in {} elements'.format(y.nMut.sum(), donors.shape[0], y.shape[0]))
+    if out_path is not None:
+        y.to_csv(out_path, sep='\t')
+        logger.info('Response table saved to {}'.format(out_path))
+    return y
+
+
+def subset_response(matrix_path, donor_path=None, exclude=False, out_path=None):
+    """ Make the response table for a subset of donors from a mutation matrix.
+
+    Args:
+        matrix_path (str): path to the mutation matrix directory from make_response.
+        donor_path (str): path to donor IDs, one per line. None for all donors.
+        exclude (bool): use all donors except those in donor_path.
+        out_path (str): path to the output response table. None for no output.
+
+    Returns:
+        pd.df: response table indexed by binID, with columns length, nMut, nSample and N.
+
+    """
+    mat, bins, length, donors = read_mut_matrix(matrix_path)
+    if donor_path is not None:
+        use_donors = pd.read_csv(donor_path, sep='\t', header=None, usecols=[0], dtype=str)[0].values
+        is_known = np.isin(use_donors, donors)
+        if not is_known.all():
+            logger.warning('{} donors not in the mutation matrix: {}'.format(
+                (~is_known).sum(), ', '.join(use_donors[~is_known][:10])))
+        is_use = np.isin(donors, use_donors)
+        if exclude:
+            is_use = ~is_use
+        logger.info('Use {}/{} donors'.format(is_use.sum(), donors.shape[0]))
+        mat = mat[:, np.where(is_use)[0]]
+    y = matrix_to_response(mat, bins, length)
+    if out_path is not None:
+        y.to_csv(out_path, sep='\t')
+        logger.info('Response table saved to {}'.format(out_path))
+    return y
+
+
+def matrix_to_response(mat, bins, length):
+    """ Response table from a bins x donors mutation matrix.
+
+    Args:
+        mat (sparse.csr_matrix): number of mutations per bin (row) and donor (column).
+        bins (np.array): binIDs of rows.
+        length (np.array): effective length of rows.
+
+    Returns:
+        pd.df: response table indexed by binID, with columns length, nMut, nSample and N.
+
+    """
+    mat = mat.tocsr()
+    mat.eliminate_zeros()
+    y = pd.DataFrame({'length': length,
+                      'nMut': np.asarray(mat.sum(axis=1)).ravel().astype(np.int_),
+                      'nSample': mat.getnnz(axis=1).astype(np.int_),
+                      'N': mat.shape[1]},
+                     index=pd.Index(bins, name='binID'),
+                     columns=['length', 'nMut', 'nSample', 'N'])
+    return y
+
+
+def read_elements(ele_path, callable_path):
+    """ Read elements and keep their whitelisted pieces.
+
+    Args:
+        ele_path (str): path to elements (chrom, start, end, binID), no header.
+        callable_path (str): path to whitelisted regions (chrom, start, end), no header.
+
+    Returns:
+        dict: {chrom: {'start', 'end', 'bin'}}, pieces sorted by start; bin is the code in bins.
+        np.array: sorted binIDs.
+
+    """
+    ele = read_bed(ele_path, [0, 1, 2, 3], ['chrom', 'start', 'end', 'binID'])
+    whitelist = read_bed(callable_path, [0, 1, 2], ['chrom', 'start', 'end'])
+    bins, ele_bin = np.unique(ele.binID.values.astype(str), return_inverse=True)
+    wl_ix = split_chrom(whitelist.chrom.values)
+    pieces = dict()
+    new_cov = 0
+    for chrom, ix in split_chrom(ele.chrom.values).items():
+        if chrom not in wl_ix:
+            continue
+        m_start, m_end = merge_intervals(whitelist.start.values[wl_ix[chrom]], whitelist.end.values[wl_ix[chrom]])
+        q_ix, start, end = intersect_merged(ele.start.values[ix], ele.end.values[ix], m_start, m_end)
+        order = np.argsort(start, kind='mergesort')
+        pieces[chrom] = {'start': start[order], 'end': end[order], 'bin': ele_bin[ix][q_ix][order]}
+        new_cov += (end - start).sum()
+    old_cov = (ele.end - ele.start).sum()
+    logger.info('Whitelisted elements: {}/{} bp ({:.2f}%)'.format(new_cov, old_cov, new_cov/old_cov*100))
+    return pieces, bins
@@ -0,0 +1,149 @@
+""" Run profiler.
+
+Records wall time, CPU time and peak resident memory (RSS) of pipeline stages,
+and per-round timings of xgboost training, and saves them as a JSON run report.
+Profiling is off unless start_profile is called; stage is then a no-op.
+
+"""
+import contextlib
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from driverpower import __version__
+import warnings
+with warnings.catch_warnings():
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    import xgboost as xgb
+
+
+logger = logging.getLogger('PROFILE')
+# Active run report; empty when profiling is off
+_REPORT = dict()
+
+
+def start_profile(command):
+    """ Turn on profiling for a run.
+
+    Args:
+        command (str): sub-command of the run, e.g., 'model' or 'infer'.
+
+    Returns:
+
+    """
+    _REPORT.clear()
+    _REPORT.update(command=command,
+                   driverpower_version=__version__,
+                   start_time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   stages=[],
+                   gbm_rounds=dict())
+    _REPORT['_start'] = _usage()
+
+
+def is_profiling():
+    return len(_REPORT) > 0
+
+
+@contextlib.contextmanager
+def stage(name):
+    """ Record wall time, CPU time and peak RSS of a pipeline stage.
+
+    CPU time includes worker processes that finished within the stage.
+    Peak RSS is the high-water mark of the main process (or its largest worker) at the end of the stage.
+    Repeated stages (e.g., chunks) are summed.
+
+    Args:
+        name (str): name of the stage.
+
+    """
+    if not is_profiling():
+        yield
+        return
+    start = _usage()
+    yield
+    end = _usage()
+    rec = [i for i in _REPORT['stages'] if i['name'] == name]
+    if len(rec) == 0:
+        rec = {'name': name, 'calls': 0, 'wall_time': 0., 'cpu_time': 0.}
+        _REPORT['stages'].append(rec)
+    else:
+        rec = rec[0]
+    rec['calls'] += 1
+    rec['wall_time'] += end['wall_time'] - start['wall_time']
+    rec['cpu_time'] += end['cpu_time'] - start['cpu_time']
+    rec['peak_rss_mb'] = end['peak_rss_mb']
+    logger.info('{}: wall time {:.2f}s, CPU time {:.2f}s, peak RSS {:.0f}MB'.format(
+        name, rec['wall_time'], rec['cpu_time'], rec['peak_rss_mb']))
+
+
+def round_timer():
+    """ Make a RoundTimer callback for xgb.train. None when profiling is off."""
+    return RoundTimer() if is_profiling() else None
+
+
+def add_gbm_rounds(k, rounds):
+    """ Add per-round records of GBM fold k to the report."""
+    if is_profiling() and rounds is not None:
+        _REPORT['gbm_rounds']['fold{}'.format(k)] = rounds
+
+
+def save_report(project_name, out_dir):
+    """ Save the run report to out_dir/project_name.run_report.json and turn off profiling.
+
+    Args:
+        project_name (str): name of the project.
+        out_dir (str): output directory.
+
+    Returns:
+        str: path to the report.
+
+    """
+    if not is_profiling():
+        return None
+    start = _REPORT.pop('_start')
+    end = _usage()
+    _REPORT['project_name'] = project_name
+    _REPORT['total'] = {'wall_time': end['wall_time'] - start['wall_time'],
+                        'cpu_time': end['cpu_time'] - start['cpu_time'],
+                        'peak_rss_mb': end['peak_rss_mb']}
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, '{}.run_report.json'.format(project_name))
+    with open(path, 'w') as f:
+        json.dump(_REPORT, f, indent=1)
+    _REPORT.clear()
+    logger.info('Run report saved to {}'.format(path))
+    return path
+
+
+def _usage():
+    """ Current wall time, CPU time (self and finished children) and peak RSS in MB."""
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    unit = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return {'wall_time': time.perf_counter(),
+            'cpu_time': self_usage.ru_utime + self_usage.ru_stime + child_usage.ru_utime + child_usage.ru_stime,
+            'peak_rss_mb': max(self_usage.ru_maxrss, child_usage.ru_maxrss) / unit}
+
+
+class RoundTimer(xgb.callback.TrainingCallback):
+    """ xgboost callback recording wall time and eval metrics of each boosting round."""
+
+    def __init__(self):
+        super(RoundTimer, self).__init__()
+        self.rounds = []
+        self._start = None
+
+    def before_iteration(self, model, epoch, evals_log):
+        self._start = time.perf_counter()
+        return False
+
+    def after_iteration(self, model, epoch, evals_log):
+        rec = {'round': epoch, 'wall_time': time.perf_counter() - self._start}
+        for data, metrics in evals_log.items():
+            for metric, values in metrics.items():
+                rec['{}-{}'.format(data, metric)] = float(values[-1])
+        self.rounds.append(rec)
+        return False
@@ -0,0 +1,4 @@
+""" Benchmarks of DriverPower on synthetic data.
+
+Run from the repository root, e.g., python -m script.benchmark.run_benchmark --out bench.json
+"""
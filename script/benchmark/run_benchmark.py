@@ -0,0 +1,144 @@
+""" Benchmark DriverPower model and infer on synthetic data
+Output: JSON with the run reports (wall time, CPU time and peak RSS of each stage)
+of driverpower.model.run_bmr and driverpower.infer.make_inference, per model and data size.
+
+Example (from the repository root):
+python -m script.benchmark.run_benchmark --bins 10000 100000 --features 50 500 --model Binomial GBM --out bench.json
+
+With several --jobs, each model is trained serially and then in parallel in the same process,
+e.g., --model GBM --gbmRound 5 --jobs 1 2, which also checks that parallel folds
+still run after xgboost has used threads in the process.
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import platform
+import sys
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+import driverpower
+from driverpower.model import run_bmr
+from driverpower.infer import make_inference
+from driverpower.dataIO import read_param
+from .synthetic import make_dataset
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s | %(levelname)s: %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S')
+# create logger
+logger = logging.getLogger('DP-benchmark')
+
+FS_CUT = 'CADD:0.01,DANN:0.03,EIGEN:0.3'
+
+
+def read_report(path):
+    """ Stages and total usage of a run report saved by driverpower.profiler."""
+    with open(path) as f:
+        report = json.load(f)
+    return {'stages': report['stages'], 'total': report['total']}
+
+
+def bench_model(model_name, paths, out_dir, param_path, kfold, fi_path=None, n_jobs=1):
+    """ Train a model with run_bmr and read its run report.
+
+    Returns:
+        dict: run report of model.
+        str: path to the saved model.
+
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    run_bmr(model_name, paths['X'], paths['y'], fi_path=fi_path, kfold=kfold, param_path=param_path,
+            project_name='benchmark', out_dir=out_dir, n_jobs=n_jobs, profile=True)
+    report = read_report(os.path.join(out_dir, 'benchmark.run_report.json'))
+    return report, os.path.join(out_dir, 'benchmark.{}.model'.format(model_name))
+
+
+def bench_infer(model_path, paths, out_dir):
+    """ Run make_inference with a trained model and read its run report.
+
+    Returns:
+        dict: run report of infer.
+
+    """
+    make_inference(model_path, paths['X'], paths['y'], fs_path=paths['fs'], fs_cut=FS_CUT,
+                   project_name='benchmark.infer', out_dir=out_dir, profile=True)
+    return read_report(os.path.join(out_dir, 'benchmark.infer.run_report.json'))
+
+
+def environment():
+    """ Versions and hardware of the benchmark run."""
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'driverpower': driverpower.__version__,
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scikit-learn': sklearn.__version__,
+            'xgboost': xgb.__version__}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DriverPower on synthetic data')
+    parser.add_argument('--out', dest='out_path', required=True, type=str, help='Path to the output JSON')
+    parser.add_argument('--workDir', dest='work_dir', required=False, type=str, default='./benchmark.data',
+                        help='Directory for synthetic data and outputs [optional]')
+    parser.add_argument('--bins', dest='bins', required=False, type=int, nargs='+', default=[10000],
+                        help='Numbers of bins [optional]')
+    parser.add_argument('--features', dest='features', required=False, type=int, nargs='+', default=[50],
+                        help='Numbers of features [optional]')
+    parser.add_argument('--model', dest='models', required=False, type=str, nargs='+',
+                        choices=['Binomial', 'NegativeBinomial', 'GBM'], default=['Binomial', 'GBM'],
+                        help='Models to benchmark [optional]')
+    parser.add_argument('--featImp', dest='use_fi', required=False, action='store_true',
+                        help='Give GLMs all features as important, skipping lasso feature selection [optional]')
+    parser.add_argument('--gbmRound', dest='n_round', required=False, type=int, default=None,
+                        help='Fixed number of boosting rounds without early stopping [optional]')
+    parser.add_argument('--gbmFold', dest='kfold', required=False, type=int, default=3,
+                        help='Train gbm with k-fold [optional]')
+    parser.add_argument('--jobs', dest='n_jobs', required=False, type=int, nargs='+', default=[1],
+                        help='Numbers of workers in model [optional]')
+    parser.add_argument('--seed', dest='seed', required=False, type=int, default=0,
+                        help='Random seed [optional]')
+    args = parser.parse_args()
+    param = read_param()
+    param['verbose_eval'] = False
+    if args.n_round is not None:
+        param['num_boost_round'] = args.n_round
+        param['early_stopping_rounds'] = None
+    results = []
+    for n_bins in args.bins:
+        for n_features in args.features:
+            data_dir = os.path.join(args.work_dir, '{}x{}'.format(n_bins, n_features))
+            paths = make_dataset(data_dir, n_bins, n_features, seed=args.seed)
+            param_path = os.path.join(data_dir, 'gbm_param.pkl')
+            with open(param_path, 'wb') as f:
+                pickle.dump(param, f)
+            fi_path = None
+            if args.use_fi:
+                fi_path = os.path.join(data_dir, 'feature_importance.tsv')
+                features = pd.read_csv(paths['X'], sep='\t', index_col='binID', nrows=0).columns
+                pd.DataFrame({'name': features, 'importance': 1.}).to_csv(fi_path, sep='\t', index=False)
+            for model_name in args.models:
+                for n_jobs in args.n_jobs:
+                    logger.info('Benchmark {} with {} bins x {} features and {} jobs'.format(
+                        model_name, n_bins, n_features, n_jobs))
+                    out_dir = os.path.join(data_dir, '{}.jobs{}'.format(model_name, n_jobs))
+                    np.random.seed(args.seed)
+                    model_report, model_path = bench_model(model_name, paths, out_dir, param_path, args.kfold,
+                                                           fi_path if model_name != 'GBM' else None, n_jobs)
+                    infer_report = bench_infer(model_path, paths, out_dir)
+                    results.append({'model_name': model_name, 'n_bins': n_bins, 'n_features': n_features,
+                                    'n_jobs': n_jobs, 'model': model_report, 'infer': infer_report})
+                    # write after each run, so finished runs are kept
+                    with open(args.out_path, 'w') as f:
+                        json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    logger.info('Benchmark results saved to {}'.format(args.out_path))
+
+
+if __name__ == '__main__':
+    main()
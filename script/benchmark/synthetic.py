@@ -0,0 +1,94 @@
+""" Generate synthetic data for DriverPower benchmarks
+Output: feature table (X.tsv), response table (y.tsv) and functional scores (fs.tsv)
+in the formats of read_feature, read_response and read_fs.
+Tables are written in chunks of bins, so large sizes (e.g., 5M bins x 1,500 features)
+do not have to fit in memory.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s | %(levelname)s: %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S')
+# create logger
+logger = logging.getLogger('DP-synthetic')
+
+SCORES = ['CADD', 'DANN', 'EIGEN']
+
+
+def make_dataset(out_dir, n_bins, n_features, n_informative=10, n_donors=2500,
+                 theta=5, seed=0, chunk_size=100000):
+    """ Write synthetic X, y and functional scores.
+
+    Mutation rates per bp per donor follow a logistic model of the first n_informative
+    features. Counts are negative binomial (gamma-Poisson) with dispersion theta.
+    Each chunk uses its own random state, so the tables only depend on seed and sizes.
+
+    Args:
+        out_dir (str): output directory.
+        n_bins (int): number of bins.
+        n_features (int): number of features.
+        n_informative (int): number of features with non-zero effect.
+        n_donors (int): number of donors (N).
+        theta (float): dispersion of counts.
+        seed (int): random seed.
+        chunk_size (int): number of bins per chunk.
+
+    Returns:
+        dict: paths of 'X', 'y' and 'fs'.
+
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {'X': os.path.join(out_dir, 'X.tsv'),
+             'y': os.path.join(out_dir, 'y.tsv'),
+             'fs': os.path.join(out_dir, 'fs.tsv')}
+    n_informative = min(n_informative, n_features)
+    beta = np.random.RandomState(seed).uniform(-0.5, 0.5, size=n_informative)
+    feature_names = ['feature{:04d}'.format(i) for i in range(n_features)]
+    logger.info('Writing {} bins x {} features to {}'.format(n_bins, n_features, out_dir))
+    for i, start in enumerate(range(0, n_bins, chunk_size)):
+        rs = np.random.RandomState([seed, i])
+        n = min(chunk_size, n_bins - start)
+        index = pd.Index(['bin{:09d}'.format(j) for j in range(start, start + n)], name='binID')
+        X = rs.randn(n, n_features)
+        X[:, n_informative::2] = rs.exponential(size=X[:, n_informative::2].shape)  # skewed features
+        # response
+        length = rs.randint(100, 3000, size=n)
+        rate = 1 / (1 + np.exp(-(-13.5 + X[:, :n_informative].dot(beta))))
+        mu = rate * length * n_donors
+        nMut = rs.poisson(rs.gamma(theta, mu / theta))
+        nSample = np.maximum(rs.binomial(nMut, 0.9), np.minimum(nMut, 1))
+        y = pd.DataFrame({'length': length, 'nMut': nMut, 'nSample': nSample, 'N': n_donors},
+                         index=index, columns=['length', 'nMut', 'nSample', 'N'])
+        # phred-scaled functional scores, with missing values
+        fs = pd.DataFrame(rs.exponential(10, size=(n, len(SCORES))), index=index, columns=SCORES)
+        fs = fs.mask(rs.rand(n, len(SCORES)) < 0.05)
+        # write chunk
+        mode, header = ('w', True) if i == 0 else ('a', False)
+        pd.DataFrame(X, index=index, columns=feature_names).to_csv(paths['X'], sep='\t', mode=mode, header=header)
+        y.to_csv(paths['y'], sep='\t', mode=mode, header=header)
+        fs.to_csv(paths['fs'], sep='\t', mode=mode, header=header)
+        logger.info('Written {}/{} bins'.format(start + n, n_bins))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic data for DriverPower benchmarks')
+    parser.add_argument('--out', dest='out_dir', required=True, type=str, help='Output directory')
+    parser.add_argument('--bins', dest='n_bins', required=False, type=int, default=10000,
+                        help='Number of bins [optional]')
+    parser.add_argument('--features', dest='n_features', required=False, type=int, default=50,
+                        help='Number of features [optional]')
+    parser.add_argument('--seed', dest='seed', required=False, type=int, default=0,
+                        help='Random seed [optional]')
+    args = parser.parse_args()
+    make_dataset(args.out_dir, args.n_bins, args.n_features, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
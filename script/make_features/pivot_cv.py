@@ -3,6 +3,8 @@
 Args:
     cvIN  - sys.argv[1]
     cvOUT - sys.argv[2]
+    --store PATH     - also save the output as a feature store [optional]
+    --chunkSize N    - number of rows read per chunk [optional]
 Input cv table (tsv with header) format:
     Column 1: binID
     Column 2-ncol: one cv per column
@@ -11,15 +13,20 @@ Output cv table format:
     Column 2-ncol: one cv per column
 Note:
     nrow(input) >= nrow(output)
+    The input is read in chunks; memory scales with nrow(output).
 '''
-import pandas as pd
+import argparse
 import sys
+from driverpower.features import collapse_features
 
 if __name__ == '__main__':
-    assert len(sys.argv) == 3, 'Incorrect number of args. Usage pivot_cv.py vIN cvOUT'
-    # read
-    cv = pd.read_csv(sys.argv[1], header=0, sep='\t')
-    cv.pivot_table(index='binID', aggfunc=sum).to_csv(sys.argv[2], header=True, sep='\t', index=True)
+    parser = argparse.ArgumentParser(description='Collapse cv table by binID')
+    parser.add_argument('cv_in', type=str, help='Input cv table')
+    parser.add_argument('cv_out', type=str, help='Output cv table')
+    parser.add_argument('--store', dest='store_path', type=str, default=None,
+                        help='Output feature store directory [optional]')
+    parser.add_argument('--chunkSize', dest='chunk_size', type=int, default=1000000,
+                        help='Number of rows read per chunk [optional]')
+    args = parser.parse_args()
+    collapse_features(args.cv_in, args.cv_out, args.store_path, args.chunk_size)
     sys.exit(0)
-    
-
@@ -15,14 +15,16 @@ setup(
     include_package_data=True,
     install_requires=[
         'numpy >= 1.13.0',
-        'scipy >= 0.18.1',
+        'scipy >= 0.19.0',
         'pandas >= 0.18.1',
-        'scikit-learn == 0.19.2',
+        'scikit-learn >= 0.19.2',
         'statsmodels >= 0.6.1',
-        'xgboost >= 0.6a',
-        'pybedtools >= 0.7.10',
+        'xgboost >= 1.3',
         'tables >= 3.4.4',
     ],
+    extras_require={
+        'arrow': ['pyarrow >= 5.0'],
+    },
     entry_points = {
         'console_scripts': [
             'driverpower=driverpower.interface:main',